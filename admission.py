@@ -0,0 +1,181 @@
+"""This python file will schedule relay jobs by priority and shed load when overloaded."""
+import threading
+import time
+from collections import deque
+
+TEXT = 0
+IMAGE = 1
+MEDIA = 2
+PRIORITY_NAMES = {TEXT: 'text', IMAGE: 'image', MEDIA: 'media'}
+
+DEFAULT_SETTINGS = {
+    'workers': 4,
+    'text_workers': 1,
+    'defer_timeout': 5,
+    'text': {'queue_size': 200, 'policy': 'defer'},
+    'image': {'queue_size': 50, 'policy': 'degrade'},
+    'media': {'queue_size': 20, 'policy': 'degrade'},
+}
+POLICIES = ('drop', 'degrade', 'defer')
+
+
+class Job:
+    """A relay job waiting in queue."""
+
+    def __init__(self, func, args, kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.enqueued_at = time.monotonic()
+
+
+class PriorityClass:
+    """Bounded queue and metrics of a priority class."""
+
+    def __init__(self, name, queue_size, policy):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown overload policy of {name}: {policy}")
+        self.name = name
+        self.queue_size = queue_size
+        self.policy = policy
+        self.jobs = deque()
+        self.metrics = {'admitted': 0, 'completed': 0, 'failed': 0, 'dropped': 0,
+                        'degraded': 0, 'deferred': 0, 'high_watermark': 0}
+        self.total_wait = 0.0
+
+    def is_full(self):
+        return len(self.jobs) >= self.queue_size
+
+    def stats(self):
+        """Get metrics of the class.
+
+        :return dict: Queue depth, capacity, counters and average wait in milliseconds.
+        """
+        started = self.metrics['completed'] + self.metrics['failed']
+        return dict(self.metrics, depth=len(self.jobs), queue_size=self.queue_size,
+                    policy=self.policy,
+                    average_wait_ms=round(self.total_wait / started * 1000, 2) if started else 0)
+
+
+class AdmissionController:
+    """Run relay jobs on a fixed pool of workers, text before images before video and audio.
+
+    Every priority class has a bounded queue. When a queue is full, the class policy decides
+    what happens to the new job: drop it, degrade it to a cheaper text job, or defer the caller
+    until there is space, so a flood of media never delays text messages.
+
+    Some workers are reserved for text: images, videos and audios can only occupy the others, so
+    text is still served while every other worker is busy with a long download.
+    """
+
+    def __init__(self, settings=None):
+        """Initialize controller and start workers.
+
+        :param dict settings: Overrides of DEFAULT_SETTINGS, from the overload section of
+        config.yml.
+        """
+        settings = settings or {}
+        self.defer_timeout = float(settings.get('defer_timeout', DEFAULT_SETTINGS['defer_timeout']))
+        self.classes = {}
+        for priority, name in PRIORITY_NAMES.items():
+            class_settings = dict(DEFAULT_SETTINGS[name], **(settings.get(name) or {}))
+            self.classes[priority] = PriorityClass(name, int(class_settings['queue_size']),
+                                                   class_settings['policy'])
+        workers = int(settings.get('workers', DEFAULT_SETTINGS['workers']))
+        text_workers = int(settings.get('text_workers', DEFAULT_SETTINGS['text_workers']))
+        text_workers = max(0, text_workers)
+        if workers - text_workers < 1:
+            print(f"overload workers ({workers}) must be more than text_workers "
+                  f"({text_workers}), starting {text_workers + 1} workers instead.")
+            workers = text_workers + 1
+        self.media_worker_limit = workers - text_workers
+        self.media_busy = 0
+        self.condition = threading.Condition()
+        for i in range(workers):
+            threading.Thread(target=self._worker, name=f'admission_{i}', daemon=True).start()
+
+    def submit(self, priority, func, *args, degrade=None, **kwargs):
+        """Submit a relay job.
+
+        :param int priority: TEXT, IMAGE or MEDIA.
+        :param func: Function to run.
+        :param degrade: Function to run as a text job instead, when the job is degraded.
+        If not given, the job is dropped under the degrade policy.
+        :return bool: True if the job or its degraded version is admitted.
+        """
+        priority_class = self.classes[priority]
+        with self.condition:
+            if priority_class.is_full() and priority_class.policy == 'defer':
+                priority_class.metrics['deferred'] += 1
+                self.condition.wait_for(lambda: not priority_class.is_full(), self.defer_timeout)
+            if not priority_class.is_full():
+                self._enqueue(priority_class, Job(func, args, kwargs))
+                return True
+            if priority_class.policy == 'degrade' and degrade is not None \
+                    and not self.classes[TEXT].is_full():
+                priority_class.metrics['degraded'] += 1
+                self._enqueue(self.classes[TEXT], Job(degrade, (), {}))
+                return True
+            priority_class.metrics['dropped'] += 1
+            print(f"Relay queue of {priority_class.name} is full, job dropped.")
+            return False
+
+    def _enqueue(self, priority_class, job):
+        """Put a job into queue, the condition must be held.
+
+        :param PriorityClass priority_class: Class of the job.
+        :param Job job: Job to put.
+        """
+        priority_class.jobs.append(job)
+        priority_class.metrics['admitted'] += 1
+        priority_class.metrics['high_watermark'] = max(priority_class.metrics['high_watermark'],
+                                                       len(priority_class.jobs))
+        self.condition.notify_all()
+
+    def _take(self):
+        """Take the job with the highest priority, blocks until there is one.
+
+        Images, videos and audios are left in queue while they occupy every unreserved worker.
+
+        :return tuple: Class and job.
+        """
+        with self.condition:
+            while True:
+                for priority in sorted(self.classes):
+                    priority_class = self.classes[priority]
+                    if priority != TEXT and self.media_busy >= self.media_worker_limit:
+                        break
+                    if priority_class.jobs:
+                        job = priority_class.jobs.popleft()
+                        if priority != TEXT:
+                            self.media_busy += 1
+                        priority_class.total_wait += time.monotonic() - job.enqueued_at
+                        self.condition.notify_all()
+                        return priority_class, job
+                self.condition.wait()
+
+    def _worker(self):
+        """Run jobs forever."""
+        while True:
+            priority_class, job = self._take()
+            try:
+                job.func(*job.args, **job.kwargs)
+            except Exception as e:
+                print(f"Failed to relay {priority_class.name} message: {e}")
+                result = 'failed'
+            else:
+                result = 'completed'
+            with self.condition:
+                priority_class.metrics[result] += 1
+                if priority_class is not self.classes[TEXT]:
+                    self.media_busy -= 1
+                    self.condition.notify_all()
+
+    def stats(self):
+        """Get saturation metrics of every class.
+
+        :return dict: Metrics by class name.
+        """
+        with self.condition:
+            return {priority_class.name: priority_class.stats()
+                    for priority_class in self.classes.values()}
@@ -0,0 +1,61 @@
+"""This python file will check that text is still relayed while media saturates the relay workers.
+
+It submits slow media jobs until every unreserved worker is busy and the media queue is not
+empty, then measures how long text jobs wait. Without reserved text workers, text waits for a
+whole media job.
+
+Run it with `python admission_benchmark.py`, the bots are not needed.
+"""
+import sys
+import threading
+import time
+
+import admission
+
+WORKERS = 2
+MEDIA_JOBS = 5
+MEDIA_SECONDS = 2.0
+TEXT_JOBS = 3
+
+
+def measure_text_latency(settings):
+    """Measure text latency while media saturates the controller.
+
+    :param dict settings: Overload settings.
+    :return list: Seconds from submit to start of each text job.
+    """
+    controller = admission.AdmissionController(settings)
+    for i in range(MEDIA_JOBS):
+        controller.submit(admission.MEDIA, time.sleep, MEDIA_SECONDS)
+    time.sleep(0.1)
+
+    latencies = []
+    done = threading.Event()
+
+    def text_job(submitted_at):
+        latencies.append(time.monotonic() - submitted_at)
+        if len(latencies) == TEXT_JOBS:
+            done.set()
+
+    for i in range(TEXT_JOBS):
+        controller.submit(admission.TEXT, text_job, time.monotonic())
+    done.wait(MEDIA_SECONDS * MEDIA_JOBS)
+    return latencies
+
+
+def main():
+    settings = {'workers': WORKERS, 'media': {'queue_size': MEDIA_JOBS, 'policy': 'drop'}}
+    latencies = measure_text_latency(settings)
+    print(f"{WORKERS} workers, {MEDIA_JOBS} media jobs of {MEDIA_SECONDS}s, {TEXT_JOBS} text jobs")
+    if len(latencies) < TEXT_JOBS:
+        print(f"FAIL: only {len(latencies)} of {TEXT_JOBS} text jobs ran.")
+        sys.exit(1)
+    print(f"text latency max {max(latencies) * 1000:.1f} ms")
+    if max(latencies) >= MEDIA_SECONDS / 2:
+        print("FAIL: text waited for media jobs.")
+        sys.exit(1)
+    print("OK: text is served while media saturates the workers.")
+
+
+if __name__ == '__main__':
+    main()
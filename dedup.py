@@ -0,0 +1,97 @@
+"""This python file will drop events that have already been processed."""
+import hashlib
+import math
+import threading
+import time
+
+
+class RollingBloomFilter:
+    """Remember keys seen in a time window using a fixed amount of memory.
+
+    The window is split into generations, each of them is a Bloom filter. New keys are added
+    to the current generation, and the oldest generation is cleared and reused when the
+    current one expires, so memory never grows no matter how many events are received.
+    A key is remembered for at least window * (generations - 1) / generations seconds.
+    """
+
+    def __init__(self, window=600, generations=4, capacity=100000, error_rate=0.0001):
+        """Initialize filter.
+
+        :param float window: How long to remember a key in seconds.
+        :param int generations: Number of generations the window is split into.
+        :param int capacity: Expected number of keys in one generation.
+        :param float error_rate: False positive rate when a generation is full.
+        """
+        self.size = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.generation_span = window / generations
+        self.filters = [bytearray(math.ceil(self.size / 8)) for _ in range(generations)]
+        self.current = 0
+        self.rotated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _indexes(self, key):
+        """Get bit indexes of a key by double hashing.
+
+        :param str key: Key to hash.
+        :return list: Bit indexes.
+        """
+        digest = hashlib.blake2b(key.encode('utf8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hash_count)]
+
+    def _rotate(self):
+        """Clear expired generations."""
+        now = time.monotonic()
+        expired = int((now - self.rotated_at) // self.generation_span)
+        if expired <= 0:
+            return
+        for _ in range(min(expired, len(self.filters))):
+            self.current = (self.current + 1) % len(self.filters)
+            self.filters[self.current] = bytearray(len(self.filters[self.current]))
+        self.rotated_at += expired * self.generation_span
+
+    def check_and_add(self, key):
+        """Check if a key has been seen, and remember it.
+
+        :param str key: Key of the event.
+        :return bool: True if the key has been seen in the window.
+        """
+        indexes = self._indexes(key)
+        with self.lock:
+            self._rotate()
+            for bloom in self.filters:
+                if all(bloom[index >> 3] & (1 << (index & 7)) for index in indexes):
+                    return True
+            bloom = self.filters[self.current]
+            for index in indexes:
+                bloom[index >> 3] |= 1 << (index & 7)
+            return False
+
+
+class EventDeduplicator:
+    """Drop redelivered or replayed events before they are processed."""
+
+    def __init__(self, window=600, capacity=100000):
+        """Initialize deduplicator.
+
+        :param float window: How long to remember an event in seconds.
+        :param int capacity: Expected number of events in a quarter of the window, the false
+        positive rate rises above it.
+        """
+        self.seen = RollingBloomFilter(window=window, capacity=capacity)
+
+    def is_duplicate(self, *keys):
+        """Check if an event has been processed.
+
+        All the keys are remembered, the event is a duplicate if any of them has been seen.
+
+        :param str keys: Keys of the event, such as event id or message id.
+        :return bool: True if the event should be dropped.
+        """
+        duplicate = False
+        for key in keys:
+            if key and self.seen.check_and_add(key):
+                duplicate = True
+        return duplicate
@@ -1,29 +1,53 @@
 """This python file will host discord bot."""
+import asyncio
+import functools
+import hashlib
 import json
 import time
 
 import discord
 import zmq
-from discord import File
 from discord import app_commands
 from discord.ext import commands
 
+import admission
+import discord_gateway
+import ipc
 import line_notify
+import media_server
+import profiling
+import traffic_capture
 import utilities as utils
+from dedup import EventDeduplicator
+from message_map import MessageMap
 
-intents = discord.Intents.default()
-intents.message_content = True
-client = commands.Bot(command_prefix="!", intents=discord.Intents.all())
+config = utils.read_config()
+client = commands.Bot(command_prefix="!",
+                      **discord_gateway.create_client_options(config['discord_intents'],
+                                                              config['discord_max_messages'],
+                                                              config['discord_cache_members']))
 
 context = zmq.Context()
 socket = context.socket(zmq.PUB)
 socket.bind("tcp://*:5555")
+publisher = ipc.Publisher(socket)
 
 supported_image_format = ('.jpg', '.png', '.jpeg')
 supported_video_format = '.mp4'
 supported_audio_format = ('.m4a', '.wav', '.mp3', '.aac', '.flac', '.ogg', '.opus')
 
-config = utils.read_config()
+admission_controller = admission.AdmissionController(config['overload'])
+event_deduplicator = EventDeduplicator(window=config['dedup_window'],
+                                       capacity=config['dedup_capacity'])
+message_map = MessageMap('./message_map', 'discord_bot')
+traffic_recorder = \
+    traffic_capture.TrafficRecorder('discord_bot') if config['traffic_capture'] else None
+
+# Discord allows at most 25 options in a select menu.
+MAX_UNLINK_OPTIONS = 25
+
+command_mentions = {}
+prebuilt_messages = {}
 
 
 @client.event
@@ -31,38 +55,100 @@ async def on_ready():
     """Initialize discord bot."""
     print("Bot is ready.")
     try:
-        synced = await client.tree.sync()
-        print(f"Synced {synced} commands.")
+        await load_command_cache()
     except Exception as e:
         print(f"Failed to sync commands: {e}")
+    build_prebuilt_messages()
+
+
+def get_command_tree_hash():
+    """Get hash of the command tree.
+
+    :return str: Hash of the commands and the application they belong to.
+    """
+    commands_data = [command.to_dict() for command in client.tree.get_commands()]
+    tree = json.dumps([client.application_id, commands_data], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(tree.encode('utf8')).hexdigest()
+
+
+async def load_command_cache():
+    """Sync commands only if the command tree has changed, and cache their mentions.
+
+    Command ids are saved in command_cache.json, so reconnecting or restarting the bot
+    doesn't need any request to Discord.
+    """
+    tree_hash = get_command_tree_hash()
+    command_cache = utils.get_command_cache()
+    if command_cache.get('tree_hash') == tree_hash and command_cache.get('command_ids'):
+        command_ids = command_cache['command_ids']
+    else:
+        synced = await client.tree.sync()
+        print(f"Synced {len(synced)} commands.")
+        command_ids = {command.name: command.id for command in synced}
+        utils.update_json('command_cache.json', {'tree_hash': tree_hash,
+                                                 'command_ids': command_ids})
+    command_mentions.clear()
+    command_mentions.update({name: f'</{name}:{command_id}>'
+                             for name, command_id in command_ids.items()})
+
+
+def get_command_mention(name):
+    """Get mention of a command.
+
+    :param str name: Command name.
+    :return str: Mention of the command, or its plain name if it hasn't been synced.
+    """
+    return command_mentions.get(name, f'/{name}')
+
+
+def build_prebuilt_messages():
+    """Build the embeds and views of /about and /help once, they are reused by every call."""
+    help_embed = discord.Embed(title="Discord <> Line message synchronization robot",
+                               description=f"`1.` {get_command_mention('about')}｜About the bot\n"
+                                           f">View the detailed information of the bot and the services currently being synchronized\n\n"
+                                           f"`2.` {get_command_mention('link')}｜Bind Line group and start synchronization\n"
+                                           f"> Please make sure you have invited Line bot/Line Notify to the group\n"
+                                           f"> and enter `!bind` in the group to get the Discord binding code\n\n"
+                                           f"`3.` {get_command_mention('unlink')}｜Unbind Line group and cancel synchronization\n"
+                                           f">Unbind the Line group and cancel the message synchronization service\n\n",
+                               color=0x2ecc71)
+    help_embed.set_author(name=client.user.name, icon_url=client.user.avatar)
+    about_embed = discord.Embed(title="Discord <> Line message synchronization robot",
+                                color=0x2ecc71)
+    about_embed.set_author(name=client.user.name, icon_url=client.user.avatar)
+    about_embed.add_field(name="author", value="LD", inline=True)
+    about_embed.add_field(name="Developer", value=config['bot_owner'], inline=True)
+    about_embed.add_field(name="Version", value="v0.2.2", inline=True)
+    prebuilt_messages['help_embed'] = help_embed
+    prebuilt_messages['about_embed'] = about_embed
+    prebuilt_messages['about_description'] = \
+        f"A free service that helps you synchronize messages between two platforms\n\n" \
+        f"Services currently being synchronized:\n" \
+        f"{{sync_info}}\n" \
+        f"This project is developed by [Finder](https://github.com/finder1793)," \
+        f"And open source welcomes everyone to maintain it\n." \
+        f"You can use the command {get_command_mention('help')} to learn how\nto use this bot\n"
+    prebuilt_messages['about_view'] = AboutCommandView()
 
 
 @client.tree.command(name="about", description="About this robot, view the services currently being synchronized")
 @app_commands.describe()
 async def about(interaction: discord.Interaction):
-    subscribed_info = utils.get_subscribed_info_by_discord_channel_id(str(interaction.channel.id))
-    if subscribed_info:
+    routes = utils.get_sync_routes_by_discord_channel_id(str(interaction.channel.id))
+    if routes:
         sync_info = f"=======================================\n" \
-                    f"Discord channel：{subscribed_info['discord_channel_name']}\n" \
-                    f"Line group      ：{subscribed_info['line_group_name']}\n" \
-                    f"=======================================\n"
+                    f"Discord channel：{routes[0]['discord_channel_name']}\n"
+        for route in routes:
+            sync_info += f"Line group      ：{route['line_group_name']}\n"
+        sync_info += f"=======================================\n"
     else:
         sync_info = f"尚未綁定任何Line群組！\n"
-    all_commands = await client.tree.fetch_commands()
-    help_command = discord.utils.get(all_commands, name="help")
-    embed_message = discord.Embed(title="Discord <> Line message synchronization robot",
-                                  description=f"A free service that helps you synchronize messages between two platforms\n\n"
-                                              f"Services currently being synchronized:\n"
-                                              f"{sync_info}\n"
-                                              f"This project is developed by [Finder](https://github.com/finder1793),"
-                                              f"And open source welcomes everyone to maintain it\n."
-                                              f"You can use the command {help_command.mention} to learn how\nto use this bot\n",
-                                  color=0x2ecc71)
-    embed_message.set_author(name=client.user.name, icon_url=client.user.avatar)
-    embed_message.add_field(name="author", value="LD", inline=True)
-    embed_message.add_field(name="Developer", value=config['bot_owner'], inline=True)
-    embed_message.add_field(name="Version", value="v0.2.2", inline=True)
-    await interaction.response.send_message(embed=embed_message, view=AboutCommandView())
+    if not prebuilt_messages:
+        build_prebuilt_messages()
+    embed_message = prebuilt_messages['about_embed'].copy()
+    embed_message.description = prebuilt_messages['about_description'].format(sync_info=sync_info)
+    await interaction.response.send_message(embed=embed_message,
+                                            view=prebuilt_messages['about_view'])
 
 
 class AboutCommandView(discord.ui.View):
@@ -91,21 +177,9 @@ class AboutCommandView(discord.ui.View):
 @client.tree.command(name="help", description="This command will help you use this bot")
 @app_commands.describe()
 async def help(interaction: discord.Interaction):
-    all_commands = await client.tree.fetch_commands()
-    about_command = discord.utils.get(all_commands, name="about")
-    link_command = discord.utils.get(all_commands, name="link")
-    unlink_command = discord.utils.get(all_commands, name="unlink")
-    embed_message = discord.Embed(title="Discord <> Line message synchronization robot",
-                                  description=f"`1.` {about_command.mention}｜About the bot\n"
-                                              f">View the detailed information of the bot and the services currently being synchronized\n\n"
-                                              f"`2.` {link_command.mention}｜Bind Line group and start synchronization\n"
-                                              f"> Please make sure you have invited Line bot/Line Notify to the group\n"
-                                              f"> and enter `!bind` in the group to get the Discord binding code\n\n"
-                                              f"`3.` {unlink_command.mention}｜Unbind Line group and cancel synchronization\n"
-                                              f">Unbind the Line group and cancel the message synchronization service\n\n",
-                                  color=0x2ecc71)
-    embed_message.set_author(name=client.user.name, icon_url=client.user.avatar)
-    await interaction.response.send_message(embed=embed_message)
+    if not prebuilt_messages:
+        build_prebuilt_messages()
+    await interaction.response.send_message(embed=prebuilt_messages['help_embed'])
 
 
 @client.tree.command(name="link", description="This command is used to bind to the Line group and synchronize messages")
@@ -115,6 +189,10 @@ async def link(interaction: discord.Interaction, binding_code: str):
     if not binding_info:
         reply_message = "Binding failed. The binding code was entered incorrectly or in an incorrect format. Please try again."
         await interaction.response.send_message(reply_message, ephemeral=True)
+    elif utils.is_sync_route_exists(binding_info['line_group_id'], str(interaction.channel.id)):
+        utils.remove_binding_code(binding_code)
+        reply_message = "Binding failed. This channel is already synced with this Line group."
+        await interaction.response.send_message(reply_message, ephemeral=True)
     elif binding_info['expiration'] < time.time():
         utils.remove_binding_code(binding_code)
         reply_message = "Binding failed. This binding code has not been used for more than 5 minutes and has expired. Please re-enter in the Line group: `!Binding`"
@@ -147,45 +225,78 @@ async def link(interaction: discord.Interaction, binding_code: str):
 @app_commands.describe()
 async def unlink(interaction: discord.Interaction):
     channel_id = str(interaction.channel.id)
-    subscribed_info = utils.get_subscribed_info_by_discord_channel_id(channel_id)
-    if not subscribed_info:
+    routes = utils.get_sync_routes_by_discord_channel_id(channel_id)
+    if not routes:
         reply_message = "This channel is not bound to any Line group!"
         await interaction.response.send_message(reply_message, ephemeral=True)
     else:
+        line_group_names = ', '.join(route['line_group_name']
+                                     for route in routes[:MAX_UNLINK_OPTIONS])
         reply_message = f"**【Discord <> Line message synchronization bot - unsynchronize!】**\n\n" \
-                        f"Discord channel: {subscribed_info['discord_channel_name']}\n" \
-                        f"Line group: {subscribed_info['line_group_name']}\n" \
+                        f"Discord channel: {routes[0]['discord_channel_name']}\n" \
+                        f"Line group: {line_group_names}\n" \
                         f"========================================\n" \
                         f"Are you sure you want to desynchronize?"
+        if len(routes) > 1:
+            reply_message += "\nDeselect the Line groups you want to keep synchronized."
+        if len(routes) > MAX_UNLINK_OPTIONS:
+            reply_message += f"\nOnly the first {MAX_UNLINK_OPTIONS} Line groups are listed, " \
+                             f"run this command again to unbind the others."
         await interaction.response.send_message(reply_message,
-                                                view=UnlinkConfirmation(subscribed_info),
+                                                view=UnlinkConfirmation(routes),
                                                 ephemeral=True)
 
 
+class UnlinkRouteSelect(discord.ui.Select):
+    """Select the routes of a channel to remove, every listed route is selected by default."""
+
+    def __init__(self, routes):
+        options = [discord.SelectOption(label=route['line_group_name'][:100],
+                                        value=str(route['sub_num']), default=True)
+                   for route in routes]
+        super().__init__(placeholder="Line groups to desynchronize", min_values=1,
+                         max_values=len(options), options=options)
+
+    async def callback(self, interaction: discord.Interaction):
+        self.view.selected_routes = [route for route in self.view.routes
+                                     if str(route['sub_num']) in self.values]
+        for option in self.options:
+            option.default = option.value in self.values
+        await interaction.response.edit_message(view=self.view)
+
+
 class UnlinkConfirmation(discord.ui.View):
-    def __init__(self, subscribed_info):
+    def __init__(self, routes):
         super().__init__(timeout=20)
-        self.subscribed_info = subscribed_info
+        # Only the routes listed in the select menu can be removed.
+        routes = routes[:MAX_UNLINK_OPTIONS]
+        self.routes = routes
+        self.selected_routes = routes
+        if len(routes) > 1:
+            self.add_item(UnlinkRouteSelect(routes))
 
     @discord.ui.button(label="⛓️Confirm desynchronization", style=discord.ButtonStyle.danger)
     async def unlink_confirm(self, interaction: discord.Interaction, button: discord.ui.Button):
-        utils.remove_sync_channel_by_discord_channel_id(self.subscribed_info['discord_channel_id'])
-        push_message = f"Unsynchronized!\n" \
-                       f" ----------------------\n" \
-                       f" | Discord <> Line |\n" \
-                       f" | Message synchronization robot |\n" \
-                       f" ----------------------\n\n" \
-                       f"Discord channel: {self.subscribed_info['discord_channel_name']}\n" \
-                       f"Line group: {self.subscribed_info['line_group_name']}\n" \
-                       f"===================\n" \
-                       f"Executor: {interaction.user.display_name}\n"
+        for route in self.selected_routes:
+            utils.remove_sync_channel_by_sub_num(route['sub_num'])
+        line_group_names = ', '.join(route['line_group_name'] for route in self.selected_routes)
         reply_message = f"**【Discord <> Line message synchronization robot - desynchronized!】**\n\n" \
-                        f"Discord channel: {self.subscribed_info['discord_channel_name']}\n" \
-                        f"Line group: {self.subscribed_info['line_group_name']}\n" \
+                        f"Discord channel: {self.routes[0]['discord_channel_name']}\n" \
+                        f"Line group: {line_group_names}\n" \
                         f"========================================\n" \
                         f"Executor: {interaction.user.display_name}\n"
         self.stop()
-        line_notify.send_message(push_message, self.subscribed_info['line_notify_token'])
+        for route in self.selected_routes:
+            push_message = f"Unsynchronized!\n" \
+                           f" ----------------------\n" \
+                           f" | Discord <> Line |\n" \
+                           f" | Message synchronization robot |\n" \
+                           f" ----------------------\n\n" \
+                           f"Discord channel: {route['discord_channel_name']}\n" \
+                           f"Line group: {route['line_group_name']}\n" \
+                           f"===================\n" \
+                           f"Executor: {interaction.user.display_name}\n"
+            line_notify.send_message(push_message, route['line_notify_token'])
         await interaction.response.send_message(reply_message)
 
     @discord.ui.button(label="Cancel operation", style=discord.ButtonStyle.primary)
@@ -196,6 +307,7 @@ class UnlinkConfirmation(discord.ui.View):
 
 
 @client.event
+@profiling.timed
 async def on_message(message):
     """Handle message event."""
     if message.author == client.user:
@@ -205,59 +317,172 @@ async def on_message(message):
         return
     subscribed_discord_channels = utils.get_subscribed_discord_channels()
     if message.channel.id in subscribed_discord_channels:
-        subscribed_info = utils.get_subscribed_info_by_discord_channel_id(str(message.channel.id))
-        sub_num = subscribed_info['sub_num']
+        if traffic_recorder is not None:
+            traffic_recorder.record_discord(message)
+        # Only synced messages are remembered, so messages of other channels don't fill up
+        # the filter.
+        if event_deduplicator.is_duplicate(f"discord_message:{message.id}"):
+            return
+        if message_map.contains('discord', message.id):
+            return
+        routes = utils.get_sync_routes_by_discord_channel_id(str(message.channel.id))
         author = message.author.display_name
+        content = message.clean_content
         if message.attachments:
             for attachment in message.attachments:
                 if attachment.filename.endswith(supported_image_format):
-                    message = message.clean_content
-                    image_file_path = utils.download_file_from_url(subscribed_info['folder_name'],
-                                                                   attachment.url,
-                                                                   attachment.filename)
-                    if message == '':
-                        message = f"{author}: Sent picture"
-                    else:
-                        message = f"{author}: {message}(picture)"
-                    line_notify.send_image_message(message, image_file_path,
-                                                   subscribed_info['line_notify_token'])
-                if attachment.filename.endswith(supported_video_format):
-                    video_file_path = utils.download_file_from_url(subscribed_info['folder_name'],
-                                                                   attachment.url,
-                                                                   attachment.filename)
-                    thumbnail_path = utils.generate_thumbnail(video_file_path)
-
-                    # Send thumbnail to discord, get url, and delete the message.
-                    thumbnail_message = await message.channel.send(thumbnail_path,
-                                                                   file=File(thumbnail_path))
-                    thumbnail_url = thumbnail_message.attachments[0].url
-                    await thumbnail_message.delete()
-
-                    message = message.clean_content
-                    send_to_line_bot('video', sub_num, author, message,
-                                     video_url=attachment.url, thumbnail_url=thumbnail_url)
-                if attachment.filename.endswith(supported_audio_format):
-                    audio_file_path = utils.download_file_from_url(sub_num, attachment.url,
-                                                                   attachment.filename)
-                    if not attachment.filename.endswith('.m4a'):
-                        audio_file_path = utils.convert_audio_to_m4a(audio_file_path)
-                    audio_duration = utils.get_audio_duration(audio_file_path)
-                    message = message.clean_content
-                    send_to_line_bot('audio', sub_num, author, message,
-                                     audio_url=attachment.url, audio_duration=audio_duration)
+                    priority, relay = admission.IMAGE, relay_image_to_line
+                elif attachment.filename.endswith(supported_video_format):
+                    priority, relay = admission.MEDIA, relay_video_to_line
+                elif attachment.filename.endswith(supported_audio_format):
+                    priority, relay = admission.MEDIA, relay_audio_to_line
                 else:
                     # TODO(LD): Handle other file types.
-                    pass
+                    continue
+                await asyncio.to_thread(
+                    admission_controller.submit, priority, relay, message, routes, author,
+                    content, attachment,
+                    degrade=functools.partial(relay_link_only_notice, message, routes, author,
+                                              content, attachment))
         else:
-            message = message.clean_content
-            line_notify.send_message(f"{author}: {message}", subscribed_info['line_notify_token'])
+            await asyncio.to_thread(admission_controller.submit, admission.TEXT,
+                                    relay_text_to_line, message, routes, author, content)
+
+
+@profiling.timed
+def relay_text_to_line(message, routes, author, content):
+    """Relay a text message to the LINE Notify of every route.
+
+    :param discord.Message message: Discord message.
+    :param list routes: Subscribed info of each route.
+    :param str author: Display name of the author.
+    :param str content: Message content.
+    """
+    failed = utils.fan_out(send_text_to_line_notify, routes, f"{author}: {content}")
+    record_relayed_message(message, routes, failed)
+
+
+@profiling.timed
+def relay_image_to_line(message, routes, author, content, attachment):
+    """Download an image and relay it to the LINE Notify of every route.
+
+    :param discord.Message message: Discord message.
+    :param list routes: Subscribed info of each route.
+    :param str author: Display name of the author.
+    :param str content: Message content.
+    :param discord.Attachment attachment: Image attachment.
+    """
+    image_file_path = utils.download_file_from_url(routes[0]['folder_name'], attachment.url,
+                                                   attachment.filename)
+    if content == '':
+        notify_message = f"{author}: Sent picture"
+    else:
+        notify_message = f"{author}: {content}(picture)"
+    failed = utils.fan_out(send_image_to_line_notify, routes, notify_message, image_file_path)
+    record_relayed_message(message, routes, failed)
+
+
+@profiling.timed
+def relay_video_to_line(message, routes, author, content, attachment):
+    """Download a video, generate its thumbnail and send it to line bot for every route.
+
+    :param discord.Message message: Discord message.
+    :param list routes: Subscribed info of each route.
+    :param str author: Display name of the author.
+    :param str content: Message content.
+    :param discord.Attachment attachment: Video attachment.
+    """
+    video_file_path = utils.download_file_from_url(routes[0]['folder_name'], attachment.url,
+                                                   attachment.filename)
+    thumbnail_path = utils.generate_thumbnail(video_file_path)
+    video_url = media_server.create_media_url(video_file_path)
+    thumbnail_url = media_server.create_media_url(thumbnail_path)
+    for route in routes:
+        send_to_line_bot('video', route['sub_num'], author, content,
+                         video_url=video_url, thumbnail_url=thumbnail_url,
+                         message_id=message.id, channel_id=message.channel.id)
+
+
+@profiling.timed
+def relay_audio_to_line(message, routes, author, content, attachment):
+    """Download an audio, convert it to m4a and send it to line bot for every route.
+
+    :param discord.Message message: Discord message.
+    :param list routes: Subscribed info of each route.
+    :param str author: Display name of the author.
+    :param str content: Message content.
+    :param discord.Attachment attachment: Audio attachment.
+    """
+    audio_file_path = utils.download_file_from_url(routes[0]['folder_name'], attachment.url,
+                                                   attachment.filename)
+    if not attachment.filename.endswith('.m4a'):
+        audio_file_path = utils.convert_audio_to_m4a(audio_file_path)
+    audio_duration = utils.get_audio_duration(audio_file_path)
+    audio_url = media_server.create_media_url(audio_file_path)
+    for route in routes:
+        send_to_line_bot('audio', route['sub_num'], author, content,
+                         audio_url=audio_url, audio_duration=audio_duration,
+                         message_id=message.id, channel_id=message.channel.id)
+
+
+def relay_link_only_notice(message, routes, author, content, attachment):
+    """Relay a link to the attachment instead of the file itself, used when the bot is busy.
+
+    :param discord.Message message: Discord message.
+    :param list routes: Subscribed info of each route.
+    :param str author: Display name of the author.
+    :param str content: Message content.
+    :param discord.Attachment attachment: Attachment to link.
+    """
+    notify_message = f"{author}: {content or attachment.filename}\n{attachment.url}"
+    failed = utils.fan_out(send_text_to_line_notify, routes, notify_message)
+    record_relayed_message(message, routes, failed)
+
+
+def record_relayed_message(message, routes, failed=()):
+    """Record a discord message relayed through LINE Notify in the message map.
+
+    LINE Notify doesn't return the id of the sent message, so only the line group is recorded.
+    Videos and audios are pushed by line bot, which records them in its own map once Line
+    accepts the push.
+
+    :param discord.Message message: Discord message.
+    :param list routes: Subscribed info of each route.
+    :param failed: Sub nums of the routes that failed.
+    """
+    for route in routes:
+        if route['sub_num'] not in failed:
+            message_map.add('discord', message.id, message.channel.id,
+                            'line', '', route['line_group_id'])
+
+
+def send_text_to_line_notify(subscribed_info, message):
+    """Send text message to the LINE Notify of a sync route.
+
+    :param dict subscribed_info: Subscribed info of the route.
+    :param str message: Message to send.
+    :raises requests.HTTPError: If LINE Notify doesn't accept the message.
+    """
+    line_notify.send_message(message, subscribed_info['line_notify_token']).raise_for_status()
+
+
+def send_image_to_line_notify(subscribed_info, message, image_path):
+    """Send image message to the LINE Notify of a sync route.
+
+    :param dict subscribed_info: Subscribed info of the route.
+    :param str message: Message to send.
+    :param str image_path: Path to image.
+    :raises requests.HTTPError: If LINE Notify doesn't accept the message.
+    """
+    line_notify.send_image_message(message, image_path,
+                                   subscribed_info['line_notify_token']).raise_for_status()
 
 
 def send_to_line_bot(msg_type, sub_num, author, message, video_url=None, thumbnail_url=None,
-                     audio_url=None, audio_duration=None):
+                     audio_url=None, audio_duration=None, message_id=None, channel_id=None):
     """Send message to line bot.
 
-    Use zmq to send messages to line bot.
+    Use zmq to send messages to line bot, messages are batched when traffic is heavy.
 
     :param msg_type: Message type, can be 'video', 'audio'.
     :param sub_num: Subscribed sync channels num.
@@ -267,19 +492,19 @@ def send_to_line_bot(msg_type, sub_num, author, message, video_url=None, thumbna
     :param thumbnail_url: Thumbnail url.
     :param audio_url: Audio url.
     :param audio_duration: Audio duration.
+    :param message_id: Id of the discord message, recorded by line bot once delivered.
+    :param channel_id: Id of the discord channel of the message.
     """
-    data = {'msg_type': msg_type, 'sub_num': sub_num, 'author': author, 'message': message}
+    data = {'msg_type': msg_type, 'sub_num': sub_num, 'author': author, 'message': message,
+            'message_id': message_id, 'channel_id': channel_id}
     if msg_type == 'video':
         data['video_url'] = video_url
         data['thumbnail_url'] = thumbnail_url
     if msg_type == 'audio':
         data['audio_url'] = audio_url
         data['audio_duration'] = audio_duration
-    json_data = json.dumps(data, ensure_ascii=False)
-    for i in range(2):
-        if i == 1:
-            socket.send_json(json_data)
-        time.sleep(1)
+    publisher.publish(data)
 
 
+profiling.install_signal_handler()
 client.run(config.get('discord_bot_token'))
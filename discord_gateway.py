@@ -0,0 +1,42 @@
+"""This python file will build the gateway settings of discord bot."""
+import discord
+
+DEFAULT_INTENTS = ('guilds', 'guild_messages', 'message_content')
+
+
+def create_intents(intent_names=DEFAULT_INTENTS):
+    """Create intents with only the given flags enabled.
+
+    :param intent_names: Names of discord.Intents flags, such as guild_messages.
+    :return discord.Intents: Intents.
+    """
+    intents = discord.Intents.none()
+    for name in intent_names:
+        if name not in discord.Intents.VALID_FLAGS:
+            raise ValueError(f"Unknown discord intent: {name}")
+        setattr(intents, name, True)
+    return intents
+
+
+def create_client_options(intent_names=DEFAULT_INTENTS, max_messages=0, cache_members=False):
+    """Create keyword arguments for discord client.
+
+    Members are not cached and guilds are not chunked by default, so memory doesn't grow with
+    the total number of members of all the servers the bot joined.
+
+    :param intent_names: Names of discord.Intents flags.
+    :param int max_messages: Number of messages to keep in cache, 0 to disable.
+    :param bool cache_members: Whether to cache guild members.
+    :return dict: Keyword arguments of discord.Client.
+    """
+    intents = create_intents(intent_names)
+    if cache_members:
+        member_cache_flags = discord.MemberCacheFlags.from_intents(intents)
+    else:
+        member_cache_flags = discord.MemberCacheFlags.none()
+    return {
+        'intents': intents,
+        'member_cache_flags': member_cache_flags,
+        'max_messages': max_messages or None,
+        'chunk_guilds_at_startup': cache_members and intents.members,
+    }
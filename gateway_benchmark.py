@@ -0,0 +1,156 @@
+"""This python file will measure memory and gateway event cost of discord bot as guilds grow.
+
+It feeds synthetic GUILD_CREATE payloads and one simulated second of gateway traffic into a
+discord.py client, without connecting to Discord. Payloads follow what Discord sends for each
+set of intents: with members and presences, guilds come with their member lists (as after
+chunking) and presence and typing events are delivered, with the minimal intents only the bot
+itself and guild messages are.
+
+Run it with `python gateway_benchmark.py [guild counts...]`, each measurement runs in its own
+process so the memory numbers don't affect each other.
+"""
+import gc
+import subprocess
+import sys
+import time
+
+import discord
+
+import discord_gateway
+
+BOT_ID = 1
+MEMBERS_PER_GUILD = 500
+MESSAGES_PER_GUILD = 2
+TYPINGS_PER_GUILD = 5
+PRESENCE_RATIO = 0.1
+
+MODES = {
+    'all intents': lambda: {'intents': discord.Intents.all()},
+    'minimal intents': discord_gateway.create_client_options,
+}
+
+
+def user_payload(user_id):
+    return {'id': str(user_id), 'username': f'user{user_id}', 'discriminator': '0',
+            'global_name': None, 'avatar': None}
+
+
+def member_payload(user_id):
+    return {'user': user_payload(user_id), 'roles': [], 'joined_at': '2023-01-01T00:00:00+00:00',
+            'deaf': False, 'mute': False, 'flags': 0}
+
+
+def guild_payload(guild_id, with_members):
+    """Create a GUILD_CREATE payload.
+
+    :param int guild_id: Guild id.
+    :param bool with_members: Whether Discord would send the member list and presences.
+    :return dict: Payload.
+    """
+    member_ids = range(guild_id * 10000, guild_id * 10000 + MEMBERS_PER_GUILD)
+    members = [member_payload(BOT_ID)]
+    presences = []
+    if with_members:
+        members += [member_payload(member_id) for member_id in member_ids]
+        presences = [{'user': {'id': str(member_id)}, 'status': 'online', 'activities': [],
+                      'client_status': {'desktop': 'online'}} for member_id in member_ids]
+    return {
+        'id': str(guild_id), 'name': f'Guild {guild_id}', 'owner_id': str(BOT_ID),
+        'member_count': MEMBERS_PER_GUILD + 1, 'large': True, 'unavailable': False,
+        'roles': [{'id': str(guild_id), 'name': '@everyone', 'permissions': '0', 'position': 0,
+                   'color': 0, 'hoist': False, 'managed': False, 'mentionable': False}],
+        'channels': [{'id': str(guild_id * 10), 'type': 0, 'name': 'general', 'position': 0,
+                      'permission_overwrites': []}],
+        'members': members, 'presences': presences, 'threads': [], 'emojis': [], 'stickers': [],
+        'features': [], 'voice_states': [], 'stage_instances': [],
+        'guild_scheduled_events': [], 'premium_tier': 0,
+    }
+
+
+def gateway_events(guild_id, with_members):
+    """Create one second of gateway events of a guild.
+
+    :param int guild_id: Guild id.
+    :param bool with_members: Whether Discord would send presence and typing events.
+    :return list: (parser name, payload) of each event.
+    """
+    events = []
+    author_id = guild_id * 10000
+    for i in range(MESSAGES_PER_GUILD):
+        events.append(('message_create', {
+            'id': str(guild_id * 1000 + i), 'channel_id': str(guild_id * 10),
+            'guild_id': str(guild_id), 'author': user_payload(author_id),
+            'member': {'roles': [], 'joined_at': '2023-01-01T00:00:00+00:00', 'deaf': False,
+                       'mute': False},
+            'content': 'hello', 'timestamp': '2023-01-01T00:00:00+00:00',
+            'edited_timestamp': None, 'tts': False, 'mention_everyone': False, 'mentions': [],
+            'mention_roles': [], 'attachments': [], 'embeds': [], 'pinned': False, 'type': 0}))
+    if with_members:
+        for i in range(TYPINGS_PER_GUILD):
+            events.append(('typing_start', {
+                'channel_id': str(guild_id * 10), 'guild_id': str(guild_id),
+                'user_id': str(author_id + i), 'timestamp': 1672531200,
+                'member': member_payload(author_id + i)}))
+        for i in range(int(MEMBERS_PER_GUILD * PRESENCE_RATIO)):
+            events.append(('presence_update', {
+                'user': {'id': str(author_id + i)}, 'guild_id': str(guild_id),
+                'status': 'idle', 'activities': [], 'client_status': {'desktop': 'idle'}}))
+    return events
+
+
+def measure(mode, guild_count):
+    """Measure a client with the given mode and number of guilds, in this process.
+
+    :param str mode: Key of MODES.
+    :param int guild_count: Number of guilds.
+    """
+    options = MODES[mode]()
+    with_members = options['intents'].members or options['intents'].presences
+    client = discord.Client(**options)
+    state = client._connection
+    for guild_id in range(1, guild_count + 1):
+        state._add_guild_from_data(guild_payload(guild_id, with_members))
+    gc.collect()
+    cached_members = sum(len(guild.members) for guild in client.guilds)
+
+    events = [event for guild_id in range(1, guild_count + 1)
+              for event in gateway_events(guild_id, with_members)]
+    start = time.process_time()
+    for name, data in events:
+        state.parsers[name.upper()](data)
+    cpu_time = time.process_time() - start
+    rss = max_rss()
+    rss_text = f'{rss / 1024:.1f}' if rss else 'n/a'
+    print(f"{mode:<18}{guild_count:>8}{cached_members:>16}{rss_text:>10}"
+          f"{len(events):>12}{cpu_time * 1000:>16.1f}")
+
+
+def max_rss():
+    """Get peak resident memory of this process.
+
+    :return int: Peak RSS in KB, 0 if not available on this platform.
+    """
+    try:
+        import resource
+    except ImportError:
+        return 0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+def main():
+    if len(sys.argv) == 4 and sys.argv[1] == '--child':
+        measure(sys.argv[2], int(sys.argv[3]))
+        return
+    guild_counts = [int(count) for count in sys.argv[1:]] or [100, 500, 1000, 2000]
+    print(f"{MEMBERS_PER_GUILD} members per guild, one simulated second of gateway events")
+    print(f"{'mode':<18}{'guilds':>8}{'cached members':>16}{'RSS MB':>10}{'events/s':>12}"
+          f"{'gateway CPU ms':>16}")
+    for mode in MODES:
+        for guild_count in guild_counts:
+            subprocess.run([sys.executable, __file__, '--child', mode, str(guild_count)],
+                           check=True)
+
+
+if __name__ == '__main__':
+    main()
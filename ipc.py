@@ -0,0 +1,100 @@
+"""This python file will pass relay jobs from discord bot to line bot.
+
+Jobs are packed into a versioned binary envelope with msgpack, and jobs queued at the same
+time are sent together in one zmq message.
+
+Wire format (zmq multipart message):
+    frame 0: TOPIC
+    frame 1: one byte of PROTOCOL_VERSION, followed by a msgpack array of jobs,
+             each job is an array of values in the order of JOB_FIELDS
+
+New fields are only appended to JOB_FIELDS, a reader ignores the values after the fields it
+knows and leaves out the fields missing from older senders.
+"""
+import queue
+import threading
+
+import msgpack
+
+TOPIC = b'relay'
+PROTOCOL_VERSION = 1
+JOB_FIELDS = ('msg_type', 'sub_num', 'author', 'message', 'video_url', 'thumbnail_url',
+              'audio_url', 'audio_duration', 'message_id', 'channel_id')
+
+
+def encode_batch(jobs):
+    """Encode relay jobs into an envelope.
+
+    :param list jobs: Jobs to encode, dicts with keys in JOB_FIELDS.
+    :return bytes: Encoded envelope.
+    """
+    rows = [[job.get(field) for field in JOB_FIELDS] for job in jobs]
+    return bytes((PROTOCOL_VERSION,)) + msgpack.packb(rows, use_bin_type=True)
+
+
+def decode_batch(envelope):
+    """Decode an envelope into relay jobs.
+
+    :param bytes envelope: Encoded envelope.
+    :return list: Decoded jobs.
+    :raises ValueError: If the envelope is not a valid batch of jobs.
+    """
+    if not envelope or envelope[0] != PROTOCOL_VERSION:
+        raise ValueError(f"Unsupported relay protocol version: {envelope[:1]!r}")
+    rows = msgpack.unpackb(envelope[1:], raw=False)
+    if not isinstance(rows, list) or not all(isinstance(row, list) for row in rows):
+        raise ValueError("Relay envelope is not an array of jobs.")
+    return [dict(zip(JOB_FIELDS, row)) for row in rows]
+
+
+def receive_batch(socket):
+    """Receive relay jobs from a zmq SUB socket.
+
+    :param socket: zmq socket subscribed to TOPIC.
+    :return list: Received jobs, empty if the message can't be decoded.
+    """
+    frames = socket.recv_multipart()
+    try:
+        return decode_batch(frames[-1])
+    except ValueError as e:
+        print(f"Failed to decode message from discord bot: {e}")
+        return []
+
+
+class Publisher:
+    """Publish relay jobs on a zmq PUB socket from a background thread.
+
+    Jobs that queue up while a batch is being sent go out together in the next batch, so
+    batching only happens when traffic is heavy and adds no delay otherwise.
+    """
+
+    def __init__(self, socket, max_batch_size=32):
+        """Initialize publisher.
+
+        The socket must not be used by other threads, zmq sockets are not thread safe.
+
+        :param socket: zmq PUB socket.
+        :param int max_batch_size: Max number of jobs in one message.
+        """
+        self.socket = socket
+        self.max_batch_size = max_batch_size
+        self.jobs = queue.Queue()
+        threading.Thread(target=self._run, name='ipc_publisher', daemon=True).start()
+
+    def publish(self, job):
+        """Queue a relay job to publish.
+
+        :param dict job: Job with keys in JOB_FIELDS.
+        """
+        self.jobs.put(job)
+
+    def _run(self):
+        """Send queued jobs in batches forever."""
+        while True:
+            batch = [self.jobs.get()]
+            while len(batch) < self.max_batch_size:
+                try:
+                    batch.append(self.jobs.get_nowait())
+                except queue.Empty:
+                    break
+            self.socket.send_multipart([TOPIC, encode_batch(batch)])
@@ -0,0 +1,69 @@
+"""This python file will compare the relay wire format with the old double json encoding.
+
+Run it with `python ipc_benchmark.py`, zmq and the bots are not needed.
+"""
+import json
+import timeit
+
+import ipc
+
+SAMPLE_JOBS = [
+    {'msg_type': 'video', 'sub_num': 12, 'author': 'LD', 'message': '今天的影片 check this out',
+     'video_url': 'https://example.ngrok.app/media/group_channel/20231001120000000000_clip.mp4'
+                  '?expires=1696766400&signature=Jx0mY1cQ2b8f1r0oJ3k7yVvY3qR6Zx2aHq1tW9sLk0E',
+     'thumbnail_url': 'https://example.ngrok.app/media/group_channel/20231001120000000000_clip'
+                      '.jpg?expires=1696766400&signature=Q0w8mZx1Yt2bV5nL7kR3sD9fG6hJ4aP1cE2uI8oT'},
+    {'msg_type': 'audio', 'sub_num': 3, 'author': 'Finder', 'message': '',
+     'audio_url': 'https://example.ngrok.app/media/group_channel/20231001120000000001_voice.m4a'
+                  '?expires=1696766400&signature=Zr3kM8pQ1wX6vB2nC9lT4yH7gF5dS0aJ3eU1iO6qW2r',
+     'audio_duration': 5230.0},
+]
+
+
+def double_json_encode(job):
+    """Encode a job like send_to_line_bot used to, json.dumps then socket.send_json."""
+    return json.dumps(json.dumps(job, ensure_ascii=False)).encode('utf8')
+
+
+def double_json_decode(data):
+    """Decode a job like receive_from_discord used to, socket.recv_json then json.loads."""
+    return json.loads(json.loads(data.decode('utf8')))
+
+
+def measure(name, encode, decode, jobs_per_message, number=20000):
+    """Measure encoding, decoding and size of messages.
+
+    :param str name: Name of the format.
+    :param encode: Function to encode a list of jobs into messages.
+    :param decode: Function to decode the messages.
+    :param int jobs_per_message: Number of jobs in each message.
+    :param int number: Number of rounds.
+    """
+    jobs = [SAMPLE_JOBS[i % len(SAMPLE_JOBS)] for i in range(jobs_per_message)]
+    messages = encode(jobs)
+    encode_time = timeit.timeit(lambda: encode(jobs), number=number)
+    decode_time = timeit.timeit(lambda: decode(messages), number=number)
+    total_jobs = number * jobs_per_message
+    size = sum(len(message) for message in messages)
+    print(f"{name:<32}{encode_time / total_jobs * 1e6:>10.2f}{decode_time / total_jobs * 1e6:>10.2f}"
+          f"{size / jobs_per_message:>12.1f}")
+
+
+def main():
+    print(f"{'format':<32}{'enc us':>10}{'dec us':>10}{'bytes/job':>12}")
+    measure('double json, 1 job/frame',
+            lambda jobs: [double_json_encode(job) for job in jobs],
+            lambda messages: [double_json_decode(message) for message in messages], 1)
+    measure('envelope v1, 1 job/frame',
+            lambda jobs: [ipc.TOPIC, ipc.encode_batch(jobs)],
+            lambda messages: ipc.decode_batch(messages[-1]), 1)
+    measure('double json, 16 jobs',
+            lambda jobs: [double_json_encode(job) for job in jobs],
+            lambda messages: [double_json_decode(message) for message in messages], 16, 2000)
+    measure('envelope v1, 16 jobs/frame',
+            lambda jobs: [ipc.TOPIC, ipc.encode_batch(jobs)],
+            lambda messages: ipc.decode_batch(messages[-1]), 16, 2000)
+
+
+if __name__ == '__main__':
+    main()
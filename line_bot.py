@@ -1,30 +1,57 @@
 """This python file will handle line webhooks."""
-import json
+import functools
+import hmac
 from threading import Thread
 
 import zmq
-from discord import SyncWebhook, File
 from flask import Flask, request, abort
 from flask.logging import create_logger
 from linebot import LineBotApi, WebhookHandler
 from linebot.exceptions import InvalidSignatureError
-from linebot.models import MessageEvent, TextMessage, ImageMessage, VideoMessage, VideoSendMessage, \
-    TextSendMessage, AudioMessage, AudioSendMessage
+from linebot.models import MessageEvent, TextMessage, ImageMessage, VideoMessage, \
+    TextSendMessage, AudioMessage
+from linebot.v3 import messaging
 
+import admission
+import ipc
 import line_notify
+import line_push
+import media_server
+import profiling
+import traffic_capture
 import utilities as utils
+from dedup import EventDeduplicator
+from message_map import MessageMap
+from webhook_dispatcher import WebhookDispatcher
 
 config = utils.read_config()
-line_bot_api = LineBotApi(config['line_channel_access_token'])
+if config['line_api_endpoint']:
+    line_bot_api = LineBotApi(config['line_channel_access_token'],
+                              endpoint=config['line_api_endpoint'],
+                              data_endpoint=config['line_api_endpoint'])
+else:
+    line_bot_api = LineBotApi(config['line_channel_access_token'])
 handler = WebhookHandler(config['line_channel_secret'])
+line_push_batcher = line_push.LinePushBatcher(config['line_channel_access_token'],
+                                              host=config['line_api_endpoint'] or None)
+traffic_recorder = \
+    traffic_capture.TrafficRecorder('line_bot') if config['traffic_capture'] else None
+webhook_dispatcher = WebhookDispatcher(merge_messages=config['merge_discord_messages'])
+event_deduplicator = EventDeduplicator(window=config['dedup_window'],
+                                       capacity=config['dedup_capacity'])
+message_map = MessageMap('./message_map', 'line_bot')
+admission_controller = admission.AdmissionController(config['overload'])
 
 app = Flask(__name__)
+app.config['USE_X_SENDFILE'] = config['media_use_x_sendfile']
+app.register_blueprint(media_server.blueprint)
 log = create_logger(app)
 
 context = zmq.Context()
 socket = context.socket(zmq.SUB)
+socket.setsockopt(zmq.RCVHWM, 1000)
 socket.connect("tcp://localhost:5555")
-socket.setsockopt_string(zmq.SUBSCRIBE, '')
+socket.setsockopt(zmq.SUBSCRIBE, ipc.TOPIC)
 
 
 @app.route("/callback", methods=['POST'])
@@ -37,6 +64,9 @@ def callback():
     # get request body as text
     body = request.get_data(as_text=True)
     log.info("Request body: %s", body)
+    # Record before handling, so the capture time is the arrival time. Unsigned bodies are not kept.
+    if traffic_recorder is not None and handler.parser.signature_validator.validate(body, signature):
+        traffic_recorder.record_line(body, utils.get_subscribed_line_channels())
 
     # handle webhook body
     try:
@@ -48,6 +78,38 @@ def callback():
     return 'OK'
 
 
+def is_admin_request():
+    """Check if the request carries the admin token.
+
+    Admin routes are disabled when admin_token is not set in config.yml.
+
+    :return bool: True if the request is authenticated.
+    """
+    if not config['admin_token']:
+        return False
+    authorization = request.headers.get('Authorization', '')
+    return hmac.compare_digest(authorization, f"Bearer {config['admin_token']}")
+
+
+@app.route("/admin/profile", methods=['POST'])
+def admin_profile():
+    """Open a profiling window, results are saved to ./profiles when it closes."""
+    if not is_admin_request():
+        abort(404)
+    seconds = profiling.clamp_seconds(request.form.get('seconds', 30, type=float))
+    if not profiling.start(seconds):
+        return 'Profiling is disabled or already running', 409
+    return f'Profiling for {seconds} seconds'
+
+
+@app.route("/admin/metrics", methods=['GET'])
+def admin_metrics():
+    """Show saturation metrics of the relay queues."""
+    if not is_admin_request():
+        abort(404)
+    return admission_controller.stats()
+
+
 @app.route("/notify", methods=['POST'])
 def notify():
     body = request.get_data(as_text=True)
@@ -75,134 +137,231 @@ def notify():
 
 
 @handler.add(MessageEvent, message=TextMessage)
+@profiling.timed
 def handle_message(event):
     """Handle message event."""
+    if is_duplicate_event(event):
+        return
     if event.source.type == 'user':
         return
     if event.source.type == 'group':
         message_received = event.message.text
-        user_id = event.source.user_id
         group_id = event.source.group_id
         reply_token = event.reply_token
         subscribed_line_channels = utils.get_subscribed_line_channels()
         if message_received == '!ID':
             line_bot_api.reply_message(reply_token, TextSendMessage(text=group_id))
         elif message_received == '!binding':
+            group_name = line_bot_api.get_group_summary(group_id).group_name
+            line_notify_state = group_id + '_' + group_name
+            auth_link = line_notify.create_auth_link(line_notify_state)
+            reply_message = f"Please click the link below to bind Line Notify first!\n" \
+                            f" and select this group on the page, click 'Agree and Link'\n" \
+                            f"After completing the binding, the system will send a set of Discord pairing codes to this group\n" \
+                            f"\n{auth_link}"
             if group_id in subscribed_line_channels:
-                reply_message = "This group has been bound"
-            else:
-                group_name = line_bot_api.get_group_summary(group_id).group_name
-                line_notify_state = group_id + '_' + group_name
-                auth_link = line_notify.create_auth_link(line_notify_state)
-                reply_message = f"Please click the link below to bind Line Notify first!\n" \
-                                f" and select this group on the page, click "Agree and Link"\n" \
-                                f"After completing the binding, the system will send a set of Discord pairing codes to this group\n" \
-                                f"\n{auth_link}"
+                routes = utils.get_sync_routes_by_line_group_id(group_id)
+                reply_message = f"This group has been bound to {len(routes)} Discord channel(s), " \
+                                f"binding again will sync it with one more channel.\n\n" \
+                                f"{reply_message}"
             line_bot_api.reply_message(reply_token, TextSendMessage(text=reply_message))
         elif group_id in subscribed_line_channels:
-            subscribed_info = utils.get_subscribed_info_by_line_group_id(group_id)
-            author = line_bot_api.get_group_member_profile(group_id, user_id).display_name
-            author_image = line_bot_api.get_group_member_profile(group_id, user_id).picture_url
-            discord_webhook = SyncWebhook.from_url(subscribed_info['discord_channel_webhook'])
-            discord_webhook.send(message_received, username=f"{author} - (Line訊息)",
-                                 avatar_url=author_image)
+            admission_controller.submit(admission.TEXT, relay_to_discord, event,
+                                        message=message_received)
 
 
 @handler.add(MessageEvent, message=ImageMessage)
+@profiling.timed
 def handle_image(event):
     """Handle image message event."""
+    if is_duplicate_event(event):
+        return
     if event.source.type == 'user':
         return
     if event.source.type == 'group':
-        user_id = event.source.user_id
-        group_id = event.source.group_id
-        subscribed_line_channels = utils.get_subscribed_line_channels()
-        if group_id in subscribed_line_channels:
-            subscribed_info = utils.get_subscribed_info_by_line_group_id(group_id)
-            author = line_bot_api.get_group_member_profile(group_id, user_id).display_name
-            author_image = line_bot_api.get_group_member_profile(group_id, user_id).picture_url
-            source = line_bot_api.get_message_content(event.message.id)
-            file_path = utils.download_file_from_line(subscribed_info['folder_name'], source,
-                                                      event.message.type)
-            discord_webhook = SyncWebhook.from_url(subscribed_info['discord_channel_webhook'])
-            discord_webhook.send(file=File(file_path), username=f"{author} - (Line訊息)",
-                                 avatar_url=author_image)
+        if event.source.group_id in utils.get_subscribed_line_channels():
+            admission_controller.submit(
+                admission.IMAGE, relay_to_discord, event, download=True,
+                username_suffix="(Line訊息)",
+                degrade=functools.partial(relay_to_discord, event,
+                                          message="Sent an image (not synced, the bot is busy)"))
 
 
 @handler.add(MessageEvent, message=VideoMessage)
+@profiling.timed
 def handle_video(event):
     """Handle video message event."""
+    if is_duplicate_event(event):
+        return
     if event.source.type == 'user':
         return
     if event.source.type == 'group':
-        user_id = event.source.user_id
-        group_id = event.source.group_id
-        subscribed_line_channels = utils.get_subscribed_line_channels()
-        if group_id in subscribed_line_channels:
-            subscribed_info = utils.get_subscribed_info_by_line_group_id(group_id)
-            author = line_bot_api.get_group_member_profile(group_id, user_id).display_name
-            author_image = line_bot_api.get_group_member_profile(group_id, user_id).picture_url
-            source = line_bot_api.get_message_content(event.message.id)
-            file_path = utils.download_file_from_line(subscribed_info['folder_name'], source,
-                                                      event.message.type)
-            discord_webhook = SyncWebhook.from_url(subscribed_info['discord_channel_webhook'])
-            discord_webhook.send(file=File(file_path), username=f"{author} - (Line)",
-                                 avatar_url=author_image)
+        if event.source.group_id in utils.get_subscribed_line_channels():
+            admission_controller.submit(
+                admission.MEDIA, relay_to_discord, event, download=True,
+                username_suffix="(Line)",
+                degrade=functools.partial(relay_to_discord, event,
+                                          message="Sent a video (not synced, the bot is busy)"))
 
 
 @handler.add(MessageEvent, message=AudioMessage)
+@profiling.timed
 def handle_audio(event):
     """Handle audio message event."""
+    if is_duplicate_event(event):
+        return
     if event.source.type == 'user':
         return
     if event.source.type == 'group':
-        user_id = event.source.user_id
-        group_id = event.source.group_id
-        subscribed_line_channels = utils.get_subscribed_line_channels()
-        if group_id in subscribed_line_channels:
-            subscribed_info = utils.get_subscribed_info_by_line_group_id(group_id)
-            author = line_bot_api.get_group_member_profile(group_id, user_id).display_name
-            author_image = line_bot_api.get_group_member_profile(group_id, user_id).picture_url
-            source = line_bot_api.get_message_content(event.message.id)
-            file_path = utils.download_file_from_line(subscribed_info['folder_name'], source,
-                                                      event.message.type)
-            discord_webhook = SyncWebhook.from_url(subscribed_info['discord_channel_webhook'])
-            discord_webhook.send(file=File(file_path), username=f"{author} - (Line)",
-                                 avatar_url=author_image)
+        if event.source.group_id in utils.get_subscribed_line_channels():
+            admission_controller.submit(
+                admission.MEDIA, relay_to_discord, event, download=True,
+                username_suffix="(Line)",
+                degrade=functools.partial(relay_to_discord, event,
+                                          message="Sent an audio (not synced, the bot is busy)"))
+
+
+def is_duplicate_event(event):
+    """Check if a line event has been processed.
+
+    Line redelivers webhooks that timed out, so the same message may be received twice.
+    Messages that have already been relayed before a restart are found in the message map.
+
+    :param event: Line message event.
+    :return bool: True if the event should be dropped.
+    """
+    if message_map.contains('line', event.message.id):
+        return True
+    keys = [f"line_message:{event.message.id}"]
+    if getattr(event, 'webhook_event_id', None):
+        keys.append(f"line_event:{event.webhook_event_id}")
+    return event_deduplicator.is_duplicate(*keys)
+
+
+@profiling.timed
+def relay_to_discord(event, message=None, download=False, username_suffix="(Line訊息)"):
+    """Relay a line group message to every discord channel synced with the group.
+
+    The author profile and the media are fetched only once, then delivered to each channel
+    concurrently.
+
+    :param event: Line message event.
+    :param str message: Text message to relay.
+    :param bool download: Whether to download the media of the message.
+    :param str username_suffix: Suffix of the webhook username.
+    """
+    group_id = event.source.group_id
+    routes = utils.get_sync_routes_by_line_group_id(group_id)
+    if not routes:
+        return
+    profile = line_bot_api.get_group_member_profile(group_id, event.source.user_id)
+    file_path = None
+    if download:
+        source = line_bot_api.get_message_content(event.message.id)
+        file_path = utils.download_file_from_line(routes[0]['folder_name'], source,
+                                                  event.message.type)
+    utils.fan_out(send_to_discord_webhook, routes, message=message, file_path=file_path,
+                  username=f"{profile.display_name} - {username_suffix}",
+                  avatar_url=profile.picture_url, line_message_id=event.message.id)
+
+
+def send_to_discord_webhook(subscribed_info, message=None, file_path=None, username=None,
+                            avatar_url=None, line_message_id=None):
+    """Send message to the discord webhook of a sync route.
+
+    The message is queued in the webhook dispatcher, which delivers it in order and within the
+    rate limits of the webhook.
+
+    :param dict subscribed_info: Subscribed info of the route.
+    :param str message: Text message.
+    :param str file_path: Path of the file to send.
+    :param str username: Webhook username.
+    :param str avatar_url: Webhook avatar url.
+    :param str line_message_id: Id of the line message, recorded in the message map once
+    delivered.
+    :return Future: Resolves to the message object returned by Discord.
+    """
+    future = webhook_dispatcher.send(subscribed_info['discord_channel_webhook'],
+                                     content=None if file_path else message, username=username,
+                                     avatar_url=avatar_url, file_path=file_path)
+    if line_message_id is not None:
+        def record_relayed_message(delivered):
+            if delivered.exception() is None:
+                message_map.add('line', line_message_id, subscribed_info['line_group_id'],
+                                'discord', delivered.result()['id'],
+                                subscribed_info['discord_channel_id'])
+
+        future.add_done_callback(record_relayed_message)
+    return future
 
 
 def receive_from_discord():
     """Receive from discord bot."""
     while True:
-        received = socket.recv_json()
-        received = json.loads(received)
-        subscribed_info = utils.get_subscribed_info_by_sub_num(received['sub_num'])
-        group_id = subscribed_info['line_group_id']
-        message = received['message']
-        if received['msg_type'] == 'video':
-            if message == "":
-                message = f"{received['author']}: Video sent"
-            else:
-                message = f"{received['author']}: {message}(video)"
-            line_notify.send_message(message, subscribed_info['line_notify_token'])
-            line_bot_api.push_message(group_id,
-                                      VideoSendMessage(
-                                          original_content_url=received['video_url'],
-                                          preview_image_url=received['thumbnail_url']))
-        if received['msg_type'] == 'audio':
-            if message == "":
-                message = f"{received['author']}: Message sent"
-            else:
-                message = f"{received['author']}: {message}(message)"
-            line_notify.send_message(message, subscribed_info['line_notify_token'])
-            line_bot_api.push_message(group_id,
-                                      AudioSendMessage(
-                                          original_content_url=received['audio_url'],
-                                          duration=received['audio_duration']))
+        for received in ipc.receive_batch(socket):
+            admission_controller.submit(admission.MEDIA, relay_to_line, received,
+                                        degrade=functools.partial(relay_link_only_notice,
+                                                                  received))
+
+
+@profiling.timed
+def relay_to_line(received):
+    """Relay a message received from discord bot to line group.
+
+    The author caption and the media are pushed in the same request. The discord message is
+    recorded in the message map once Line accepts the push, and skipped if it's already there,
+    as discord bot sends it again when Discord replays the message.
+
+    :param dict received: Message sent by discord bot.
+    """
+    subscribed_info = utils.get_subscribed_info_by_sub_num(received['sub_num'])
+    group_id = subscribed_info['line_group_id']
+    discord_message_id = received.get('message_id')
+    on_sent = None
+    if discord_message_id is not None:
+        if any(counterpart['channel_id'] == group_id
+               for counterpart in message_map.lookup('discord', discord_message_id)):
+            return
+
+        def on_sent():
+            message_map.add('discord', discord_message_id, received.get('channel_id'),
+                            'line', '', group_id)
+    message = received['message']
+    if received['msg_type'] == 'video':
+        if message == "":
+            message = f"{received['author']}: Video sent"
+        else:
+            message = f"{received['author']}: {message}(video)"
+        line_push_batcher.push(group_id, [
+            messaging.TextMessage(text=message),
+            messaging.VideoMessage(original_content_url=received['video_url'],
+                                   preview_image_url=received['thumbnail_url'])], on_sent)
+    if received['msg_type'] == 'audio':
+        if message == "":
+            message = f"{received['author']}: Message sent"
+        else:
+            message = f"{received['author']}: {message}(message)"
+        line_push_batcher.push(group_id, [
+            messaging.TextMessage(text=message),
+            messaging.AudioMessage(original_content_url=received['audio_url'],
+                                   duration=int(received['audio_duration']))], on_sent)
+
+
+def relay_link_only_notice(received):
+    """Relay a link to the media instead of the media itself, used when the bot is busy.
+
+    :param dict received: Message sent by discord bot.
+    """
+    subscribed_info = utils.get_subscribed_info_by_sub_num(received['sub_num'])
+    media_url = received.get('video_url') or received.get('audio_url')
+    message = received['message'] or f"{received['msg_type'].capitalize()} sent"
+    message = f"{received['author']}: {message}\n{media_url}"
+    line_notify.send_message(message, subscribed_info['line_notify_token'])
 
 
 thread = Thread(target=receive_from_discord)
 thread.start()
+profiling.install_signal_handler()
 
 if __name__ == "__main__":
     app.run()
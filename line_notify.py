@@ -16,11 +16,12 @@ def send_message(message, notify_token):
 
     :param str message: Message to send.
     :param str notify_token: LINE Notify token.
+    :return requests.Response: Response from LINE Notify.
     """
     headers = {"Authorization": "Bearer " + notify_token}
     data = {'message': message}
-    requests.post("https://notify-api.line.me/api/notify",
-                  headers=headers, data=data, timeout=5)
+    return requests.post("https://notify-api.line.me/api/notify",
+                         headers=headers, data=data, timeout=5)
 
 
 def send_image_message(message, image_path, notify_token):
@@ -29,14 +30,15 @@ def send_image_message(message, image_path, notify_token):
     :param str message: Message to send.
     :param str image_path: Path to media.
     :param str notify_token: LINE Notify token.
+    :return requests.Response: Response from LINE Notify.
     """
     headers = {"Authorization": "Bearer " + notify_token}
     data = {'message': message}
     with open(image_path, 'rb') as f:
         image = f.read()
     files = {'imageFile': image}
-    requests.post("https://notify-api.line.me/api/notify",
-                  headers=headers, data=data, files=files, timeout=5)
+    return requests.post("https://notify-api.line.me/api/notify",
+                         headers=headers, data=data, files=files, timeout=5)
 
 
 def create_auth_link(state):
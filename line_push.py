@@ -0,0 +1,127 @@
+"""This python file will push messages to LINE groups in batches."""
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from linebot.v3.messaging import ApiClient, ApiException, Configuration, MessagingApi, \
+    PushMessageRequest
+
+MAX_MESSAGES_PER_PUSH = 5
+MAX_RETRIES = 3
+
+
+class LinePushBatcher:
+    """Group messages for the same LINE group into as few push requests as possible.
+
+    Messages pushed to a group within a short window are sent together, up to five message
+    objects per request, over a pooled keep-alive connection. Pushes of a group are sent in
+    order, one request at a time, while different groups are pushed concurrently.
+    """
+
+    def __init__(self, channel_access_token, window=0.3, pool_size=4, host=None):
+        """Initialize batcher and start the flusher thread.
+
+        :param str channel_access_token: Line bot channel access token.
+        :param float window: Seconds to wait for more messages of the same group.
+        :param int pool_size: Max number of concurrent push requests and pooled connections.
+        :param str host: Messaging API host, default is https://api.line.me.
+        """
+        configuration = Configuration(host=host, access_token=channel_access_token)
+        configuration.connection_pool_maxsize = pool_size
+        self.messaging_api = MessagingApi(ApiClient(configuration))
+        self.window = window
+        self.executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='line_push')
+        self.condition = threading.Condition()
+        self.pending = {}
+        self.in_flight = set()
+        threading.Thread(target=self._flusher, name='line_push_flusher', daemon=True).start()
+
+    def push(self, group_id, messages, on_sent=None):
+        """Queue messages to push to a group.
+
+        Messages of one call are always sent in the same request, so a caption stays with its
+        media.
+
+        :param str group_id: Line group id.
+        :param list messages: Message objects of linebot.v3.messaging, at most five.
+        :param on_sent: Function called without arguments once Line has accepted the push.
+        """
+        if not 0 < len(messages) <= MAX_MESSAGES_PER_PUSH:
+            raise ValueError(f"Can only push 1 to {MAX_MESSAGES_PER_PUSH} messages at once.")
+        with self.condition:
+            if group_id not in self.pending:
+                self.pending[group_id] = (time.monotonic() + self.window, [])
+            self.pending[group_id][1].append((messages, on_sent))
+            self.condition.notify()
+
+    def _flusher(self):
+        """Send pending messages of each group once its window is over."""
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                next_deadline = None
+                for group_id, (deadline, jobs) in list(self.pending.items()):
+                    if group_id in self.in_flight:
+                        continue
+                    if deadline > now:
+                        next_deadline = min(next_deadline or deadline, deadline)
+                        continue
+                    messages = []
+                    callbacks = []
+                    while jobs and len(messages) + len(jobs[0][0]) <= MAX_MESSAGES_PER_PUSH:
+                        job_messages, on_sent = jobs.pop(0)
+                        messages.extend(job_messages)
+                        if on_sent is not None:
+                            callbacks.append(on_sent)
+                    if not jobs:
+                        del self.pending[group_id]
+                    self.in_flight.add(group_id)
+                    self.executor.submit(self._send, group_id, messages, callbacks)
+                timeout = None if next_deadline is None else next_deadline - now
+                self.condition.wait(timeout)
+
+    def _send(self, group_id, messages, callbacks):
+        """Push messages to a group, retrying with the same retry key.
+
+        :param str group_id: Line group id.
+        :param list messages: Message objects to push.
+        :param list callbacks: on_sent functions of the pushed jobs.
+        """
+        retry_key = str(uuid.uuid4())
+        request = PushMessageRequest(to=group_id, messages=messages)
+        try:
+            for attempt in range(MAX_RETRIES + 1):
+                try:
+                    self.messaging_api.push_message(request, x_line_retry_key=retry_key)
+                    self._run_callbacks(callbacks)
+                    return
+                except ApiException as e:
+                    # 409 means a request with the same retry key has already been accepted.
+                    if e.status == 409:
+                        self._run_callbacks(callbacks)
+                        return
+                    if (e.status != 429 and e.status < 500) or attempt == MAX_RETRIES:
+                        print(f"Failed to push message to line group {group_id}: {e.status}")
+                        return
+                except Exception as e:
+                    if attempt == MAX_RETRIES:
+                        print(f"Failed to push message to line group {group_id}: {e}")
+                        return
+                time.sleep(2 ** attempt)
+        finally:
+            with self.condition:
+                self.in_flight.discard(group_id)
+                self.condition.notify()
+
+    @staticmethod
+    def _run_callbacks(callbacks):
+        """Run on_sent functions of pushed jobs.
+
+        :param list callbacks: Functions to run.
+        """
+        for on_sent in callbacks:
+            try:
+                on_sent()
+            except Exception as e:
+                print(f"Failed to run callback of pushed message: {e}")
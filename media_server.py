@@ -0,0 +1,70 @@
+"""This python file will serve downloaded media files on the webhook url.
+
+Line needs public urls to fetch videos, thumbnails and audios sent by the line bot, so the
+files in ./downloads are served here through signed urls that expire.
+"""
+import base64
+import hashlib
+import hmac
+import os
+import time
+import urllib.parse
+
+from flask import Blueprint, abort, request, send_file
+from werkzeug.security import safe_join
+
+import utilities as utils
+
+config = utils.read_config()
+webhook_url = config['webhook_url']
+media_url_ttl = config['media_url_ttl']
+signing_key = hmac.new(config['line_channel_secret'].encode('utf8'), b'media_server',
+                       hashlib.sha256).digest()
+media_root = os.path.abspath('./downloads')
+
+blueprint = Blueprint('media_server', __name__)
+
+
+def sign(media_path, expires):
+    """Sign a media path.
+
+    :param str media_path: Path of the file relative to ./downloads, with forward slashes.
+    :param int expires: Unix time the url expires.
+    :return str: Url-safe signature.
+    """
+    digest = hmac.new(signing_key, f'{media_path}\n{expires}'.encode('utf8'),
+                      hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b'=').decode('ascii')
+
+
+def create_media_url(file_path, ttl=None):
+    """Create a signed public url of a downloaded file.
+
+    :param str file_path: Path of the file, must be inside ./downloads.
+    :param int ttl: Seconds before the url expires, default is media_url_ttl in config.yml.
+    :return str: Public url of the file.
+    """
+    media_path = os.path.relpath(os.path.abspath(file_path), media_root).replace(os.sep, '/')
+    expires = int(time.time()) + (ttl or media_url_ttl)
+    query = urllib.parse.urlencode({'expires': expires, 'signature': sign(media_path, expires)})
+    return f"{webhook_url.rstrip('/')}/media/{urllib.parse.quote(media_path)}?{query}"
+
+
+@blueprint.route('/media/<path:media_path>', methods=['GET', 'HEAD'])
+def serve_media(media_path):
+    """Serve a downloaded file.
+
+    Range and conditional requests are handled by send_file. The built-in server of Flask reads
+    and writes the file in chunks; with media_use_x_sendfile, only an X-Sendfile header is
+    returned and a fronting server that supports it, such as Apache with mod_xsendfile or
+    lighttpd, sends the file itself with zero-copy sendfile.
+    """
+    expires = request.args.get('expires', 0, type=int)
+    signature = request.args.get('signature', '')
+    if expires < time.time() or not hmac.compare_digest(signature, sign(media_path, expires)):
+        abort(403)
+    file_path = safe_join(media_root, media_path)
+    if file_path is None or not os.path.isfile(file_path):
+        abort(404)
+    return send_file(file_path, conditional=True, etag=True,
+                     max_age=max(0, int(expires - time.time())))
@@ -0,0 +1,445 @@
+"""This python file will record which message a relayed message became on the other platform."""
+import atexit
+import hashlib
+import mmap
+import os
+import struct
+import threading
+RECORD_HEADER = struct.Struct('<QqH')
+INDEX_HEADER = struct.Struct('<QQqq')
+ESTIMATED_RECORD_SIZE = 100
+FIELD_SEPARATOR = '\x1f'
+OFFSET_BITS = 40
+OFFSET_MASK = (1 << OFFSET_BITS) - 1
+EMPTY = 0
+
+
+def allocate_table(typecode, capacity):
+    """Allocate a zeroed column of a hash table in anonymous memory.
+
+    The pages are zeroed lazily by the OS when first touched, so even a table of millions of
+    slots is allocated at once, instead of being filled with zeros while the lock is held.
+
+    :param str typecode: 'Q' or 'q', both 8 bytes per slot.
+    :param int capacity: Number of slots.
+    :return memoryview: Column of the table.
+    """
+    return memoryview(mmap.mmap(-1, 8 * capacity)).cast(typecode)
+
+
+def key_hash(platform, message_id):
+    """Hash a message key into a non-zero 64 bits integer.
+
+    :param str platform: Platform of the message, 'line' or 'discord'.
+    :param message_id: Message id.
+    :return int: Hash of the key.
+    """
+    digest = hashlib.blake2b(f'{platform}:{message_id}'.encode('utf8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little') or 1
+
+
+class HashIndex:
+    """Open addressing hash table from key hash to record position.
+
+    Keys and positions are stored in two flat arrays in anonymous memory, which takes 16 bytes
+    per slot instead of hundreds of bytes per entry of a python dict.
+
+    The table grows incrementally: when it's 70% full, a table of twice the size is allocated
+    and every put moves MIGRATE_STEP slots of the old table into it, so no single put stalls
+    on rehashing millions of entries. Lookups check the new table, then the old one.
+    """
+
+    MIGRATE_STEP = 256
+
+    def __init__(self, capacity=1 << 16):
+        self.keys = allocate_table('Q', capacity)
+        self.positions = allocate_table('q', capacity)
+        self.mask = capacity - 1
+        self.count = 0
+        self.min_position = 0
+        self.old = None
+        self.migrated = 0
+
+    @staticmethod
+    def _find(keys, mask, key):
+        """Find the slot of a key in a table, or the empty slot it should go to.
+
+        :param memoryview keys: Keys of the table.
+        :param int mask: Capacity of the table minus one.
+        :param int key: Key hash.
+        :return int: Slot index.
+        """
+        slot = key & mask
+        while keys[slot] != EMPTY and keys[slot] != key:
+            slot = (slot + 1) & mask
+        return slot
+
+    def get(self, key):
+        """Get position of a key.
+
+        :param int key: Key hash.
+        :return int: Record position, -1 if not found or removed.
+        """
+        slot = self._find(self.keys, self.mask, key)
+        if self.keys[slot] == key:
+            position = self.positions[slot]
+        elif self.old is not None:
+            old_keys, old_positions, old_mask = self.old
+            slot = self._find(old_keys, old_mask, key)
+            if old_keys[slot] != key:
+                return -1
+            position = old_positions[slot]
+        else:
+            return -1
+        return position if position >= self.min_position else -1
+
+    def put(self, key, position):
+        """Set position of a key.
+
+        :param int key: Key hash.
+        :param int position: Record position.
+        """
+        if self.old is not None:
+            self._migrate(self.MIGRATE_STEP)
+        elif (self.count + 1) * 10 > (self.mask + 1) * 7:
+            self._start_rehash((self.mask + 1) * 2)
+        self._insert(key, position, replace=True)
+
+    def remove_below(self, min_position):
+        """Remove entries whose position is lower than min_position.
+
+        They are hidden from lookups at once, and dropped from the table by an incremental
+        rehash of the same size.
+
+        :param int min_position: Lowest position to keep.
+        """
+        self.min_position = max(self.min_position, min_position)
+        self._start_rehash(self.mask + 1)
+
+    def _insert(self, key, position, replace):
+        """Insert a key into the current table.
+
+        :param int key: Key hash.
+        :param int position: Record position.
+        :param bool replace: Whether to overwrite the position of an existing key.
+        """
+        slot = self._find(self.keys, self.mask, key)
+        if self.keys[slot] == EMPTY:
+            self.keys[slot] = key
+            self.count += 1
+        elif not replace:
+            return
+        self.positions[slot] = position
+
+    def _start_rehash(self, capacity):
+        """Allocate a new table and start moving the entries of the current one into it.
+
+        :param int capacity: Number of slots of the new table, a power of two.
+        """
+        if self.old is not None:
+            self._migrate(len(self.old[0]))
+        self.old = (self.keys, self.positions, self.mask)
+        self.migrated = 0
+        self.keys = allocate_table('Q', capacity)
+        self.positions = allocate_table('q', capacity)
+        self.mask = capacity - 1
+        self.count = 0
+
+    def _migrate(self, slots):
+        """Move slots of the old table into the current one.
+
+        Keys put since the rehash started are newer than the old table, so they are kept.
+
+        :param int slots: Number of slots to move.
+        """
+        old_keys, old_positions, _ = self.old
+        end = min(self.migrated + slots, len(old_keys))
+        for i in range(self.migrated, end):
+            key = old_keys[i]
+            if key != EMPTY and old_positions[i] >= self.min_position:
+                self._insert(key, old_positions[i], replace=False)
+        self.migrated = end
+        if end == len(old_keys):
+            self.old = None
+
+    def finish_rehash(self):
+        """Move every remaining slot of the old table, if a rehash is running."""
+        if self.old is not None:
+            self._migrate(len(self.old[0]))
+
+
+class MessageMap:
+    """Append-only log mapping relayed message ids across platforms.
+
+    Every relay writes two records, from the source message to its counterpart and back, so a
+    message can be looked up from either side. Records of the same key are chained by the
+    position of the previous record, so a message relayed to several routes has all of its
+    counterparts. The log is split into segments that rotate by size, and only the hash index
+    is kept in memory.
+
+    The index is saved to disk when a segment rotates and when the process exits, so a restart
+    loads it in one read and only scans the records written after it was saved.
+    """
+
+    def __init__(self, directory, name, max_segment_size=64 * 1024 * 1024, max_segments=8):
+        """Initialize message map, load the saved index and scan the log written after it.
+
+        :param str directory: Folder to store the log.
+        :param str name: Name of the log, each process should use its own name.
+        :param int max_segment_size: Size in bytes to rotate a segment.
+        :param int max_segments: Number of segments to keep.
+        """
+        self.directory = directory
+        self.name = name
+        self.max_segment_size = max_segment_size
+        self.max_segments = max_segments
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock()
+        self.readers = {}
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        segments = self._list_segments()
+        saved_position = self._load_index(segments)
+        if saved_position is None:
+            saved_position = 0
+            self.index = HashIndex(self._estimate_capacity(segments))
+        for segment in segments:
+            if segment >= saved_position >> OFFSET_BITS:
+                start = saved_position & OFFSET_MASK if segment == saved_position >> OFFSET_BITS \
+                    else 0
+                self._load_segment(segment, start)
+        self.segment = segments[-1] if segments else 0
+        self.writer = open(self._segment_path(self.segment), 'ab')
+        atexit.register(self.close)
+
+    def _segment_path(self, segment):
+        return os.path.join(self.directory, f'{self.name}.{segment:06d}.log')
+
+    def _index_path(self):
+        return os.path.join(self.directory, f'{self.name}.index')
+
+    def _estimate_capacity(self, segments):
+        """Size the index for the records in the log, so loading it doesn't grow the table.
+
+        :param list segments: Segment numbers.
+        :return int: Number of slots, a power of two.
+        """
+        records = sum(os.path.getsize(self._segment_path(segment))
+                      for segment in segments) // ESTIMATED_RECORD_SIZE
+        capacity = 1 << 16
+        while capacity * 7 < records * 10:
+            capacity *= 2
+        return capacity
+
+    def _load_index(self, segments):
+        """Load the saved index.
+
+        :param list segments: Segment numbers.
+        :return int: Position of the log the index covers, None if there is no usable index.
+        """
+        path = self._index_path()
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'rb') as f:
+                capacity, count, min_position, saved_position = \
+                    INDEX_HEADER.unpack(f.read(INDEX_HEADER.size))
+                if capacity & (capacity - 1) or count > capacity:
+                    raise ValueError(f"invalid capacity {capacity}")
+                keys = allocate_table('Q', capacity)
+                positions = allocate_table('q', capacity)
+                if f.readinto(keys.cast('B')) != 8 * capacity or \
+                        f.readinto(positions.cast('B')) != 8 * capacity:
+                    raise EOFError("index is truncated")
+        except (OSError, EOFError, ValueError, struct.error):
+            print(f"Message map index {path} is broken, rebuilding it from the log.")
+            return None
+        saved_segment = saved_position >> OFFSET_BITS
+        if saved_segment > (segments[-1] if segments else 0) or (
+                saved_segment in segments and os.path.getsize(self._segment_path(saved_segment))
+                < saved_position & OFFSET_MASK):
+            print(f"Message map index {path} doesn't match the log, rebuilding it.")
+            return None
+        self.index = HashIndex(1)
+        self.index.keys = keys
+        self.index.positions = positions
+        self.index.mask = capacity - 1
+        self.index.count = count
+        self.index.min_position = min_position
+        return saved_position
+
+    def _save_index(self, saved_position, wait):
+        """Save a copy of the index, the lock must be held.
+
+        The tables are copied under the lock, which is a single memory copy, and written to disk
+        in a background thread unless wait is set.
+
+        :param int saved_position: Position of the log the index covers.
+        :param bool wait: Whether to write in this thread.
+        """
+        if self.index.old is not None:
+            if not wait:
+                return
+            self.index.finish_rehash()
+        header = INDEX_HEADER.pack(self.index.mask + 1, self.index.count, self.index.min_position,
+                                   saved_position)
+        keys = bytes(self.index.keys)
+        positions = bytes(self.index.positions)
+
+        def write():
+            with self.save_lock:
+                path = self._index_path()
+                with open(f'{path}.tmp', 'wb') as f:
+                    f.write(header)
+                    f.write(keys)
+                    f.write(positions)
+                os.replace(f'{path}.tmp', path)
+
+        if wait:
+            write()
+        else:
+            threading.Thread(target=write, name='message_map_save', daemon=True).start()
+
+    def _list_segments(self):
+        """List segment numbers in the folder.
+
+        :return list: Sorted segment numbers.
+        """
+        segments = []
+        for filename in os.listdir(self.directory):
+            prefix, _, rest = filename.partition('.')
+            number, _, extension = rest.partition('.')
+            if prefix == self.name and extension == 'log' and number.isdigit():
+                segments.append(int(number))
+        return sorted(segments)
+
+    def _load_segment(self, segment, start=0):
+        """Scan a segment through mmap and add its records to the index.
+
+        A partially written record at the end, left by a crash, is truncated.
+
+        :param int segment: Segment number.
+        :param int start: Offset of the first record to scan.
+        """
+        path = self._segment_path(segment)
+        size = os.path.getsize(path)
+        if size <= start:
+            return
+        offset = start
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            while offset + RECORD_HEADER.size <= size:
+                key, _, length = RECORD_HEADER.unpack_from(data, offset)
+                if offset + RECORD_HEADER.size + length > size:
+                    break
+                self.index.put(key, (segment << OFFSET_BITS) | offset)
+                offset += RECORD_HEADER.size + length
+        if offset != size:
+            with open(path, 'r+b') as f:
+                f.truncate(offset)
+
+    def _read(self, position):
+        """Read the record at position.
+
+        :param int position: Record position.
+        :return tuple: Key hash, previous position and fields, None if the segment is removed.
+        """
+        segment = position >> OFFSET_BITS
+        if segment not in self.readers:
+            path = self._segment_path(segment)
+            if not os.path.exists(path):
+                return None
+            self.readers[segment] = open(path, 'rb', buffering=0)
+        reader = self.readers[segment]
+        reader.seek(position & OFFSET_MASK)
+        key, previous, length = RECORD_HEADER.unpack(reader.read(RECORD_HEADER.size))
+        fields = reader.read(length).decode('utf8').split(FIELD_SEPARATOR)
+        return key, previous, fields
+
+    def _append(self, platform, message_id, fields):
+        """Append a record of a key to the log.
+
+        :param str platform: Platform of the message.
+        :param message_id: Message id.
+        :param list fields: Fields of the counterpart.
+        """
+        key = key_hash(platform, message_id)
+        body = FIELD_SEPARATOR.join([platform, str(message_id)] + fields).encode('utf8')
+        if self.writer.tell() + RECORD_HEADER.size + len(body) > self.max_segment_size:
+            self._rotate()
+        position = (self.segment << OFFSET_BITS) | self.writer.tell()
+        self.writer.write(RECORD_HEADER.pack(key, self.index.get(key), len(body)) + body)
+        self.index.put(key, position)
+
+    def _rotate(self):
+        """Start a new segment and remove the oldest ones."""
+        self.writer.close()
+        self.segment += 1
+        self.writer = open(self._segment_path(self.segment), 'ab')
+        self._save_index(self.segment << OFFSET_BITS, wait=False)
+        oldest = self.segment - self.max_segments + 1
+        removed = [segment for segment in self._list_segments() if segment < oldest]
+        for segment in removed:
+            if segment in self.readers:
+                self.readers.pop(segment).close()
+            os.remove(self._segment_path(segment))
+        if removed:
+            self.index.remove_below(oldest << OFFSET_BITS)
+
+    def add(self, src_platform, src_id, src_channel, dst_platform, dst_id, dst_channel):
+        """Record that a message has been relayed.
+
+        :param str src_platform: Platform of the source message, 'line' or 'discord'.
+        :param src_id: Id of the source message.
+        :param src_channel: Line group id or discord channel id of the source message.
+        :param str dst_platform: Platform the message was relayed to.
+        :param dst_id: Id of the relayed message, empty if the platform doesn't return one.
+        :param dst_channel: Line group id or discord channel id the message was relayed to.
+        """
+        with self.lock:
+            self._append(src_platform, src_id, [dst_platform, str(dst_id or ''), str(dst_channel)])
+            if dst_id:
+                self._append(dst_platform, dst_id, [src_platform, str(src_id), str(src_channel)])
+            self.writer.flush()
+
+    def lookup(self, platform, message_id):
+        """Get counterparts of a message.
+
+        :param str platform: Platform of the message, 'line' or 'discord'.
+        :param message_id: Message id.
+        :return list: Dicts include platform, message_id and channel_id of each counterpart,
+        newest first.
+        """
+        key = key_hash(platform, message_id)
+        counterparts = []
+        with self.lock:
+            position = self.index.get(key)
+            while position >= 0:
+                record = self._read(position)
+                if record is None:
+                    break
+                _, position, fields = record
+                if fields[0] == platform and fields[1] == str(message_id):
+                    counterparts.append({'platform': fields[2], 'message_id': fields[3],
+                                         'channel_id': fields[4]})
+        return counterparts
+
+    def contains(self, platform, message_id):
+        """Check if a message has been relayed.
+
+        :param str platform: Platform of the message, 'line' or 'discord'.
+        :param message_id: Message id.
+        :return bool: True if the message has been relayed.
+        """
+        return bool(self.lookup(platform, message_id))
+
+    def close(self):
+        """Save the index and close the log."""
+        with self.lock:
+            if self.writer.closed:
+                return
+            self.writer.flush()
+            self._save_index((self.segment << OFFSET_BITS) | self.writer.tell(), wait=True)
+            self.writer.close()
+            for reader in self.readers.values():
+                reader.close()
+            self.readers.clear()
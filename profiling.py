@@ -0,0 +1,206 @@
+"""This python file will profile the bots on demand.
+
+Profiling is off unless profiling_enabled is set in config.yml, and then handlers wrapped by
+timed() are returned untouched, so it costs nothing when it's off.
+"""
+import asyncio
+import datetime
+import functools
+import os
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+import utilities as utils
+
+config = utils.read_config()
+enabled = config['profiling_enabled']
+process_name = os.path.splitext(os.path.basename(sys.argv[0]))[0] or 'python'
+
+MIN_SECONDS = 1
+MAX_SECONDS = 300
+
+lock = threading.Lock()
+active = False
+call_timings = {}
+
+
+def timed(func):
+    """Record the time of each call while a profiling window is open.
+
+    Works with both functions and coroutine functions.
+
+    :param func: Handler to wrap.
+    :return: Wrapped handler, or the handler itself if profiling is disabled.
+    """
+    if not enabled:
+        return func
+    name = f'{func.__module__}.{func.__qualname__}'
+
+    if asyncio.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            if not active:
+                return await func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                record_timing(name, time.perf_counter() - start)
+
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not active:
+            return func(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            record_timing(name, time.perf_counter() - start)
+
+    return wrapper
+
+
+def record_timing(name, duration):
+    """Record the duration of a call.
+
+    :param str name: Name of the handler.
+    :param float duration: Duration in seconds.
+    """
+    with lock:
+        timing = call_timings.setdefault(name, [0, 0.0, 0.0])
+        timing[0] += 1
+        timing[1] += duration
+        timing[2] = max(timing[2], duration)
+
+
+def clamp_seconds(seconds):
+    """Limit the length of a profiling window to MIN_SECONDS to MAX_SECONDS.
+
+    :param float seconds: Requested length.
+    :return float: Length of the window.
+    """
+    if not seconds >= MIN_SECONDS:  # Also true for nan.
+        return MIN_SECONDS
+    return min(seconds, MAX_SECONDS)
+
+
+def start(seconds=30, interval=0.005):
+    """Open a profiling window.
+
+    Stacks of every thread are sampled during the window, and the results are dumped to
+    ./profiles when it closes.
+
+    :param float seconds: Length of the window, limited by clamp_seconds.
+    :param float interval: Sampling interval in seconds.
+    :return bool: False if profiling is disabled or a window is already open.
+    """
+    global active
+    with lock:
+        if not enabled or active:
+            return False
+        active = True
+        call_timings.clear()
+    threading.Thread(target=_run, args=(clamp_seconds(seconds), interval), name='profiler',
+                     daemon=True).start()
+    return True
+
+
+def _run(seconds, interval):
+    """Sample stacks until the window closes, then dump the results.
+
+    :param float seconds: Length of the window.
+    :param float interval: Sampling interval in seconds.
+    """
+    global active
+    tracing_memory = tracemalloc.is_tracing()
+    if not tracing_memory:
+        tracemalloc.start(25)
+    stacks = Counter()
+    own_thread = threading.get_ident()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id != own_thread:
+                stacks[_collapse(frame)] += 1
+        time.sleep(interval)
+    snapshot = tracemalloc.take_snapshot()
+    if not tracing_memory:
+        tracemalloc.stop()
+    with lock:
+        timings = dict(call_timings)
+        active = False
+    path = _dump(stacks, snapshot, timings)
+    print(f"Profiling finished, results saved to {path}")
+
+
+def _collapse(frame):
+    """Collapse a stack into a single line of folded stack format.
+
+    :param frame: Top frame of the stack.
+    :return str: Frames from root to leaf, separated by semicolons.
+    """
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+def _dump(stacks, snapshot, timings):
+    """Dump profiling results to disk.
+
+    Writes a folded stacks file that can be read by flamegraph.pl or speedscope, a tracemalloc
+    snapshot with a summary of top allocations, and the timings of each handler.
+
+    :param Counter stacks: Sample count of each collapsed stack.
+    :param tracemalloc.Snapshot snapshot: Allocation snapshot.
+    :param dict timings: Count, total and max duration of each handler.
+    :return str: Path prefix of the dumped files.
+    """
+    if not os.path.exists('./profiles'):
+        os.makedirs('./profiles')
+    prefix = f'./profiles/{process_name}_{datetime.datetime.now().strftime("%Y%m%d%H%M%S")}'
+    with open(f'{prefix}.folded', 'w', encoding="utf8") as f:
+        for stack, count in stacks.most_common():
+            f.write(f'{stack} {count}\n')
+    snapshot.dump(f'{prefix}.tracemalloc')
+    with open(f'{prefix}_allocations.txt', 'w', encoding="utf8") as f:
+        for stat in snapshot.statistics('lineno')[:50]:
+            f.write(f'{stat}\n')
+    with open(f'{prefix}_timings.txt', 'w', encoding="utf8") as f:
+        for name, (count, total, longest) in sorted(timings.items(), key=lambda x: -x[1][1]):
+            f.write(f'{name}: {count} calls, avg {total / count * 1000:.2f}ms, '
+                    f'max {longest * 1000:.2f}ms\n')
+    return prefix
+
+
+def install_signal_handler(seconds=30):
+    """Open a profiling window when the process receives SIGUSR1.
+
+    Signals are not available on Windows, use the admin route of line bot instead.
+
+    The handler runs on the main thread between any two bytecodes, possibly while the main
+    thread holds lock in record_timing, so it only sets an event and the window is opened by
+    a separate thread.
+
+    :param float seconds: Length of the window.
+    """
+    if not enabled or not hasattr(signal, 'SIGUSR1'):
+        return
+    requested = threading.Event()
+
+    def wait_for_signal():
+        while True:
+            requested.wait()
+            requested.clear()
+            start(seconds)
+
+    threading.Thread(target=wait_for_signal, name='profiler_signal', daemon=True).start()
+    signal.signal(signal.SIGUSR1, lambda signum, frame: requested.set())
@@ -0,0 +1,197 @@
+"""This python file will capture incoming traffic so it can be replayed offline.
+
+Only the traffic the bots relay is captured: messages of synced Discord channels and Line groups.
+Captures are gzip compressed json lines saved in ./captures, one file per process start. Each
+record is stamped with the wall clock time, so captures of line bot and discord bot can be
+merged on one timeline. Reply tokens are removed and user, group and message ids are replaced by hashes, so a capture
+keeps who sent what to where without exposing any of them.
+"""
+import atexit
+import datetime
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+
+FLUSH_EVERY = 20
+SUPPORTED_IMAGE_FORMAT = ('.jpg', '.png', '.jpeg')
+SUPPORTED_VIDEO_FORMAT = ('.mp4',)
+SUPPORTED_AUDIO_FORMAT = ('.m4a', '.wav', '.mp3', '.aac', '.flac', '.ogg', '.opus')
+
+
+def pseudonymize(value):
+    """Replace an id by a short stable hash.
+
+    :param value: Id to replace.
+    :return str: Hash of the id.
+    """
+    return hashlib.sha256(str(value).encode('utf8')).hexdigest()[:16]
+
+
+def redact_line_body(body, group_ids):
+    """Redact secrets and ids from a LINE webhook body.
+
+    Only events of the given groups are kept, so messages from 1:1 chats are left out.
+
+    :param str body: Raw webhook body.
+    :param group_ids: Ids of the line groups to keep events of.
+    :return dict: Redacted body.
+    """
+    data = json.loads(body)
+    data.pop('destination', None)
+    data['events'] = [event for event in data.get('events', [])
+                      if event.get('source', {}).get('groupId') in group_ids]
+    for event in data['events']:
+        if 'replyToken' in event:
+            event['replyToken'] = 'REDACTED'
+        for key in ('userId', 'groupId', 'roomId'):
+            if key in event.get('source', {}):
+                event['source'][key] = pseudonymize(event['source'][key])
+        message = event.get('message', {})
+        for key in ('id', 'quotedMessageId'):
+            if key in message:
+                message[key] = pseudonymize(message[key])
+        for mentionee in message.get('mention', {}).get('mentionees', []):
+            if 'userId' in mentionee:
+                mentionee['userId'] = pseudonymize(mentionee['userId'])
+        # Members of memberJoined and memberLeft events.
+        for key in ('joined', 'left'):
+            for member in event.get(key, {}).get('members', []):
+                if 'userId' in member:
+                    member['userId'] = pseudonymize(member['userId'])
+        if 'messageId' in event.get('unsend', {}):
+            event['unsend']['messageId'] = pseudonymize(event['unsend']['messageId'])
+        if 'webhookEventId' in event:
+            event['webhookEventId'] = pseudonymize(event['webhookEventId'])
+    return data
+
+
+def get_line_traffic_type(data):
+    """Get traffic type of a LINE webhook body.
+
+    :param dict data: Webhook body.
+    :return str: Message type of the first event, or the event type if it's not a message.
+    """
+    events = data.get('events', [])
+    if not events:
+        return 'empty'
+    return events[0].get('message', {}).get('type', events[0].get('type', 'unknown'))
+
+
+def get_attachment_type(filename):
+    """Get traffic type of a discord attachment.
+
+    :param str filename: Attachment filename.
+    :return str: image, video, audio or other.
+    """
+    filename = filename.lower()
+    if filename.endswith(SUPPORTED_IMAGE_FORMAT):
+        return 'image'
+    if filename.endswith(SUPPORTED_VIDEO_FORMAT):
+        return 'video'
+    if filename.endswith(SUPPORTED_AUDIO_FORMAT):
+        return 'audio'
+    return 'other'
+
+
+def normalize_discord_message(message):
+    """Normalize a discord message into a redacted event.
+
+    Attachment urls are signed by Discord, so only their metadata is kept.
+
+    :param discord.Message message: Discord message.
+    :return dict: Normalized event.
+    """
+    return {
+        'message_id': pseudonymize(message.id),
+        'channel_id': pseudonymize(message.channel.id),
+        'author_id': pseudonymize(message.author.id),
+        'content': message.clean_content,
+        'attachments': [{'filename': attachment.filename, 'size': attachment.size,
+                         'content_type': attachment.content_type,
+                         'type': get_attachment_type(attachment.filename)}
+                        for attachment in message.attachments],
+    }
+
+
+class TrafficRecorder:
+    """Write captured traffic to a compressed capture file."""
+
+    def __init__(self, name, directory='./captures'):
+        """Open a new capture file.
+
+        :param str name: Name of the process, used in the file name.
+        :param str directory: Folder to save captures.
+        """
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self.path = os.path.join(
+            directory, f'{name}_{datetime.datetime.now().strftime("%Y%m%d%H%M%S")}.jsonl.gz')
+        self.file = gzip.open(self.path, 'at', encoding='utf8')
+        self.lock = threading.Lock()
+        self.unflushed = 0
+        atexit.register(self.close)
+
+    def _write(self, source, traffic_type, data):
+        """Write a record.
+
+        :param str source: line or discord.
+        :param str traffic_type: Type of the message, such as text or video.
+        :param dict data: Redacted data.
+        """
+        record = {'t': round(time.time(), 6), 'source': source, 'type': traffic_type,
+                  'data': data}
+        with self.lock:
+            self.file.write(json.dumps(record, ensure_ascii=False) + '\n')
+            self.unflushed += 1
+            if self.unflushed >= FLUSH_EVERY:
+                self.file.flush()
+                self.unflushed = 0
+
+    def record_line(self, body, group_ids):
+        """Record events of synced groups in a LINE webhook body.
+
+        :param str body: Raw webhook body.
+        :param group_ids: Ids of the synced line groups.
+        """
+        try:
+            data = redact_line_body(body, group_ids)
+        except ValueError:
+            return
+        if not data['events']:
+            return
+        self._write('line', get_line_traffic_type(data), data)
+
+    def record_discord(self, message):
+        """Record a discord message, only messages of synced channels should be recorded.
+
+        :param discord.Message message: Discord message.
+        """
+        data = normalize_discord_message(message)
+        traffic_type = data['attachments'][0]['type'] if data['attachments'] else 'text'
+        self._write('discord', traffic_type, data)
+
+    def close(self):
+        """Flush and close the capture file."""
+        with self.lock:
+            if not self.file.closed:
+                self.file.close()
+
+
+def read_capture(path):
+    """Read records of a capture file.
+
+    :param str path: Path of the capture file.
+    :return: Generator of records, sorted by time as they were written.
+    """
+    with gzip.open(path, 'rt', encoding='utf8') as f:
+        try:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+        except (EOFError, ValueError):
+            # The capture was not closed properly, the last record is incomplete.
+            return
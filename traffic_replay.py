@@ -0,0 +1,301 @@
+"""This python file will replay captured traffic against a local line bot.
+
+The replayer hosts stand-in services for the Line Messaging API and Discord webhooks, so the
+line bot can run without reaching any real platform:
+
+1. Set line_api_endpoint in config.yml to http://127.0.0.1:<stand-in port>
+2. Bind a sync channel whose discord_channel_webhook is
+   http://127.0.0.1:<stand-in port>/api/webhooks/1/replay and line_group_id is the --group-id
+3. Stop discord bot, the replayer publishes relay jobs on its zmq port instead
+4. Start line bot, then run `python traffic_replay.py <capture files> --line-secret <secret>`
+
+Line messages are posted to the callback with a fresh signature. Discord videos and audios are
+published as relay jobs; other Discord messages are sent to LINE Notify by discord bot itself,
+so they can't be replayed against line bot and are only counted. Every replayed message gets
+its own author name, replay<seq>, which the stand-in services read back from the relayed
+message to measure the delivery latency of each message.
+"""
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import re
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+import zmq
+
+import ipc
+import traffic_capture
+
+MEDIA_SIZES = {'image': 200 * 1024, 'video': 3 * 1024 * 1024, 'audio': 100 * 1024}
+REPLAY_AUTHOR = re.compile(r'replay(\d+)')
+
+
+class ReplayResults:
+    """Send and delivery times of each replayed message."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.records = {}
+        self.media_types = {}
+
+    def sent(self, seq, source, traffic_type):
+        with self.lock:
+            self.records[seq] = {'source': source, 'type': traffic_type,
+                                 'sent_at': time.monotonic(), 'ack_latency': None,
+                                 'error': None, 'delivered_at': None}
+
+    def acked(self, seq, ack_latency, error=None):
+        with self.lock:
+            self.records[seq]['ack_latency'] = ack_latency
+            self.records[seq]['error'] = error
+
+    def delivered(self, text):
+        """Record delivery of every message whose author is found in text.
+
+        A push to Line can carry several messages, as pushes to the same group are batched.
+
+        :param str text: Text sent to a stand-in service.
+        """
+        now = time.monotonic()
+        with self.lock:
+            for match in REPLAY_AUTHOR.finditer(text):
+                record = self.records.get(int(match.group(1)))
+                if record is not None and record['delivered_at'] is None:
+                    record['delivered_at'] = now
+
+    def pending(self):
+        with self.lock:
+            return sum(1 for record in self.records.values()
+                       if record['delivered_at'] is None and record['error'] is None)
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Stand-in for the Line Messaging API and Discord webhooks."""
+
+    results = None
+    message_count = 0
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status=200, body=b'{}', content_type='application/json'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        profile = re.fullmatch(r'/v2/bot/group/[^/]+/member/([^/]+)', path)
+        content = re.fullmatch(r'/v2/bot/message/(\d+)/content', path)
+        media = re.fullmatch(r'/media/\d+\.(\w+)', path)
+        if profile:
+            user_id = profile.group(1)
+            self._reply(body=json.dumps({'displayName': user_id, 'userId': user_id,
+                                         'pictureUrl': ''}).encode('utf8'))
+        elif content:
+            media_type = self.results.media_types.get(content.group(1), 'image')
+            self._reply(body=bytes(MEDIA_SIZES.get(media_type, 1024)),
+                        content_type='application/octet-stream')
+        elif media:
+            media_type = 'video' if media.group(1) in ('mp4', 'jpg') else 'audio'
+            self._reply(body=bytes(MEDIA_SIZES[media_type]), content_type='application/octet-stream')
+        else:
+            self._reply(404)
+
+    do_HEAD = do_GET
+
+    def do_POST(self):
+        path = self.path.split('?')[0]
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if path == '/v2/bot/message/push':
+            self.results.delivered(body.decode('utf8', 'replace'))
+            self._reply()
+        elif path == '/v2/bot/message/reply':
+            self._reply()
+        elif re.fullmatch(r'/api/webhooks/\d+/[^/]+', path):
+            # Webhook posts with files are multipart, the username is in payload_json.
+            self.results.delivered(body[:4096].decode('utf8', 'replace'))
+            StandInHandler.message_count += 1
+            self._reply(body=json.dumps({'id': str(StandInHandler.message_count)}).encode('utf8'))
+        else:
+            self._reply(404)
+
+
+def start_stand_in_server(port, results):
+    """Start stand-in services in a background thread.
+
+    :param int port: Port to listen.
+    :param ReplayResults results: Results to record deliveries to.
+    :return ThreadingHTTPServer: The server.
+    """
+    StandInHandler.results = results
+    server = ThreadingHTTPServer(('127.0.0.1', port), StandInHandler)
+    threading.Thread(target=server.serve_forever, name='stand_in', daemon=True).start()
+    return server
+
+
+def replay_line(seq, record, args, session, results):
+    """Post a captured LINE webhook body to line bot.
+
+    Ids are replaced so the message is not dropped as a duplicate, even when the same capture
+    is replayed again, and can be traced.
+
+    :param int seq: Sequence number of the record.
+    :param dict record: Captured record.
+    :param args: Command line arguments.
+    :param requests.Session session: Http session.
+    :param ReplayResults results: Results to record to.
+    """
+    data = json.loads(json.dumps(record['data']))
+    data['destination'] = 'replay'
+    for index, event in enumerate(data.get('events', [])):
+        source = event.get('source', {})
+        source['userId'] = f'replay{seq}'
+        if 'groupId' in source:
+            source['groupId'] = args.group_id
+        if 'message' in event:
+            event['message']['id'] = f'{args.run_id}{seq * 100 + index}'
+            results.media_types[event['message']['id']] = event['message'].get('type')
+        event.pop('webhookEventId', None)
+    body = json.dumps(data, ensure_ascii=False).encode('utf8')
+    signature = base64.b64encode(hmac.new(args.line_secret.encode('utf8'), body,
+                                          hashlib.sha256).digest()).decode('ascii')
+    results.sent(seq, 'line', record['type'])
+    start = time.monotonic()
+    try:
+        response = session.post(args.line_callback, data=body, timeout=30,
+                                headers={'X-Line-Signature': signature,
+                                         'Content-Type': 'application/json'})
+        error = None if response.ok else f'HTTP {response.status_code}'
+    except requests.RequestException as e:
+        error = str(e)
+    results.acked(seq, time.monotonic() - start, error)
+
+
+def replay_discord(seq, record, args, publisher, results):
+    """Publish a captured discord video or audio as a relay job to line bot.
+
+    :param int seq: Sequence number of the record.
+    :param dict record: Captured record.
+    :param args: Command line arguments.
+    :param ipc.Publisher publisher: Relay job publisher.
+    :param ReplayResults results: Results to record to.
+    """
+    stand_in_url = f'http://127.0.0.1:{args.stand_in_port}'
+    job = {'msg_type': record['type'], 'sub_num': args.sub_num, 'author': f'replay{seq}',
+           'message': record['data'].get('content', '')}
+    if record['type'] == 'video':
+        job['video_url'] = f'{stand_in_url}/media/{seq}.mp4'
+        job['thumbnail_url'] = f'{stand_in_url}/media/{seq}.jpg'
+    else:
+        job['audio_url'] = f'{stand_in_url}/media/{seq}.m4a'
+        job['audio_duration'] = 5000
+    results.sent(seq, 'discord', record['type'])
+    publisher.publish(job)
+
+
+def percentile(values, ratio):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * ratio))]
+
+
+def report(results, skipped):
+    """Print latency distributions by source and type.
+
+    :param ReplayResults results: Replay results.
+    :param dict skipped: Number of records that can't be replayed, by source and type.
+    """
+    groups = defaultdict(list)
+    for record in results.records.values():
+        groups[(record['source'], record['type'])].append(record)
+    print(f"{'source':<9}{'type':<10}{'sent':>6}{'errors':>7}{'ack p50':>9}{'ack p99':>9}"
+          f"{'delivered':>10}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}   (ms)")
+    for (source, traffic_type), records in sorted(groups.items()):
+        acks = [record['ack_latency'] * 1000 for record in records
+                if record['ack_latency'] is not None and record['error'] is None]
+        deliveries = [(record['delivered_at'] - record['sent_at']) * 1000 for record in records
+                      if record['delivered_at'] is not None]
+        errors = sum(1 for record in records if record['error'] is not None)
+        line = f"{source:<9}{traffic_type:<10}{len(records):>6}{errors:>7}"
+        line += f"{percentile(acks, 0.5):>9.1f}{percentile(acks, 0.99):>9.1f}" if acks \
+            else f"{'-':>9}{'-':>9}"
+        line += f"{len(deliveries):>10}"
+        if deliveries:
+            line += ''.join(f"{percentile(deliveries, ratio):>9.1f}" for ratio in (0.5, 0.9, 0.99))
+            line += f"{max(deliveries):>9.1f}"
+        print(line)
+    for (source, traffic_type), count in sorted(skipped.items()):
+        print(f"{source:<9}{traffic_type:<10}{count:>6} not replayable offline, skipped")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay captured traffic against a local line bot.")
+    parser.add_argument('captures', nargs='+', help="Capture files in ./captures")
+    parser.add_argument('--speed', default='1',
+                        help="Replay speed, such as 1 or 10 for 10x, or max to send without waiting")
+    parser.add_argument('--line-callback', default='http://127.0.0.1:5000/callback')
+    parser.add_argument('--line-secret', required=True,
+                        help="channel_secret in the config.yml of the local line bot")
+    parser.add_argument('--group-id', default='replay-group',
+                        help="Line group id of the sync channel used for replay")
+    parser.add_argument('--sub-num', type=int, default=1,
+                        help="sub_num of the sync channel used for replay")
+    parser.add_argument('--stand-in-port', type=int, default=5600)
+    parser.add_argument('--ipc-address', default='tcp://*:5555')
+    parser.add_argument('--drain', type=float, default=30,
+                        help="Seconds to wait for deliveries after the last message")
+    args = parser.parse_args()
+    speed = None if args.speed == 'max' else float(args.speed)
+    args.run_id = int(time.time())
+
+    records = [record for path in args.captures for record in traffic_capture.read_capture(path)]
+    records.sort(key=lambda record: record['t'])
+    if not records:
+        print("No records found.")
+        return
+
+    results = ReplayResults()
+    server = start_stand_in_server(args.stand_in_port, results)
+    socket = zmq.Context().socket(zmq.PUB)
+    socket.bind(args.ipc_address)
+    publisher = ipc.Publisher(socket)
+    time.sleep(1)  # Let line bot connect to the zmq port.
+    session = requests.Session()
+    executor = ThreadPoolExecutor(max_workers=32)
+    skipped = defaultdict(int)
+
+    print(f"Replaying {len(records)} records at {args.speed}x speed...")
+    first_t = records[0]['t']
+    started_at = time.monotonic()
+    for seq, record in enumerate(records, start=1):
+        if speed is not None:
+            time.sleep(max(0.0, started_at + (record['t'] - first_t) / speed - time.monotonic()))
+        if record['source'] == 'line':
+            executor.submit(replay_line, seq, record, args, session, results)
+        elif record['type'] in ('video', 'audio'):
+            replay_discord(seq, record, args, publisher, results)
+        else:
+            skipped[(record['source'], record['type'])] += 1
+    executor.shutdown(wait=True)
+
+    deadline = time.monotonic() + args.drain
+    while results.pending() and time.monotonic() < deadline:
+        time.sleep(0.1)
+    server.shutdown()
+    print(f"Replay finished in {time.monotonic() - started_at:.1f}s, "
+          f"{results.pending()} messages not delivered.")
+    report(results, skipped)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,6 +6,7 @@ import random
 import subprocess
 import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
 from os.path import exists
 
 import requests
@@ -55,6 +56,67 @@ Discord_bot:
 line_bot_invite_link: ''
 discord_bot_invite_link: ''
 
+# (Advanced settings)
+# Merge consecutive text messages from the same Line user into one Discord message
+# This helps to keep up with Discord rate limits when a group chat is busy
+merge_discord_messages: true
+# How long (in seconds) to remember processed messages, so redelivered ones won't be synced twice
+dedup_window: 600
+# How many synced messages to expect in a quarter of dedup_window, raise it for busy servers
+# Messages may be dropped by mistake once more than this are received, it takes 1 MB per 100000
+dedup_capacity: 100000
+
+# Token for the admin routes of line bot, such as /admin/profile
+# Admin routes are disabled if this is left empty
+admin_token: ''
+# Allow profiling the bots on demand, by sending SIGUSR1 or calling /admin/profile
+# Results will be saved to ./profiles
+profiling_enabled: false
+
+# How long (in seconds) the urls of files sent to Line stay valid
+# Files are served from ./downloads on your webhook url, at /media
+media_url_ttl: 604800
+# By default the bot reads and sends the files itself, in chunks
+# If the bot is behind a web server that supports X-Sendfile (Apache with mod_xsendfile, lighttpd),
+# turn this on to let the web server send the files, with zero-copy sendfile
+media_use_x_sendfile: false
+
+# Discord gateway events the bot subscribes to
+# The bot only needs guilds, guild_messages and message_content, enabling more (such as members
+# or presences) makes Discord send many more events and increases memory usage
+discord_intents:
+  - guilds
+  - guild_messages
+  - message_content
+# Number of Discord messages to keep in cache, 0 to disable
+discord_max_messages: 0
+# Cache members of every server, memory will grow with the total members of all servers
+discord_cache_members: false
+
+# Record incoming messages to ./captures, so they can be replayed by traffic_replay.py
+# Reply tokens are removed and ids are hashed, but message text is kept
+traffic_capture: false
+# Send Line API requests to another host, such as the stand-in services of traffic_replay.py
+# Leave it empty to use the real Line API
+line_api_endpoint: ''
+
+# What to do when the bot is overloaded
+# Messages are queued by type, text messages are always synced before images, videos and audios
+# policy can be drop, degrade (send a notice or a link instead of the file) or defer (wait for space)
+overload:
+  workers: 4
+  # Workers only used by text messages, so long downloads can't hold up text
+  text_workers: 1
+  text:
+    queue_size: 200
+    policy: defer
+  image:
+    queue_size: 50
+    policy: degrade
+  media:
+    queue_size: 20
+    policy: degrade
+
 """
                 )
     sys.exit()
@@ -89,6 +151,20 @@ def read_config():
                 config['line_bot_invite_link'] = data['line_bot_invite_link']
             if data['discord_bot_invite_link']:
                 config['discord_bot_invite_link'] = data['discord_bot_invite_link']
+            config['merge_discord_messages'] = bool(data.get('merge_discord_messages', True))
+            config['dedup_window'] = float(data.get('dedup_window', 600))
+            config['dedup_capacity'] = int(data.get('dedup_capacity', 100000))
+            config['admin_token'] = data.get('admin_token') or ''
+            config['profiling_enabled'] = bool(data.get('profiling_enabled', False))
+            config['overload'] = data.get('overload') or {}
+            config['traffic_capture'] = bool(data.get('traffic_capture', False))
+            config['line_api_endpoint'] = data.get('line_api_endpoint') or ''
+            config['media_url_ttl'] = int(data.get('media_url_ttl', 604800))
+            config['media_use_x_sendfile'] = bool(data.get('media_use_x_sendfile', False))
+            config['discord_intents'] = data.get('discord_intents') or \
+                ['guilds', 'guild_messages', 'message_content']
+            config['discord_max_messages'] = int(data.get('discord_max_messages') or 0)
+            config['discord_cache_members'] = bool(data.get('discord_cache_members', False))
             return config
     except (KeyError, TypeError):
         print(
@@ -101,6 +177,8 @@ def read_config():
 def get_subscribed_discord_channels():
     """Get subscribed discord channels.
 
+    A channel synced with several line groups is only listed once.
+
     :return list: Subscribed discord channels.
     """
     if not exists('./sync_channels.json'):
@@ -109,7 +187,8 @@ def get_subscribed_discord_channels():
             json.dump([], file, indent=4)
             file.close()
     data = json.load(open('sync_channels.json', 'r', encoding="utf8"))
-    subscribed_discord_channels = [int(entry['discord_channel_id']) for entry in data]
+    subscribed_discord_channels = list(dict.fromkeys(int(entry['discord_channel_id'])
+                                                      for entry in data))
     return subscribed_discord_channels
 
 
@@ -120,38 +199,100 @@ def get_subscribed_line_channels():
             json.dump([], file, indent=4)
             file.close()
     data = json.load(open('sync_channels.json', 'r', encoding="utf8"))
-    subscribed_line_channels = [entry['line_group_id'] for entry in data]
+    subscribed_line_channels = list(dict.fromkeys(entry['line_group_id'] for entry in data))
     return subscribed_line_channels
 
 
 def get_subscribed_info_by_discord_channel_id(discord_channel_id):
     """Get subscribed info by discord channel id.
 
+    Only the first route is returned, use get_sync_routes_by_discord_channel_id() to get all of
+    the line groups that the channel is synced with.
+
     :param int discord_channel_id: Discord channel id.
     :return dict: Subscribed info. Include line_group_id, line_notify_token, discord_channel_id,
     discord_channel_webhook and sub_num.
     """
-    data = json.load(open('sync_channels.json', 'r', encoding="utf8"))
-    for index, entry in enumerate(data):
-        if entry['discord_channel_id'] == discord_channel_id:
-            subscribed_info = entry.copy()
-            return subscribed_info
-    return {}
+    routes = get_sync_routes_by_discord_channel_id(discord_channel_id)
+    return routes[0] if routes else {}
 
 
 def get_subscribed_info_by_line_group_id(line_group_id):
     """Get subscribed info by line group id.
 
+    Only the first route is returned, use get_sync_routes_by_line_group_id() to get all of
+    the discord channels that the group is synced with.
+
     :param str line_group_id: Line group id.
     :return dict: Subscribed info. Include line_group_id, line_notify_token, discord_channel_id,
     discord_channel_webhook and sub_num.
     """
+    routes = get_sync_routes_by_line_group_id(line_group_id)
+    return routes[0] if routes else {}
+
+
+def get_sync_routes_by_discord_channel_id(discord_channel_id):
+    """Get every sync route of a discord channel.
+
+    A discord channel can be synced with several line groups, each of them is a route.
+
+    :param str discord_channel_id: Discord channel id.
+    :return list: Subscribed info of each route, sorted by sub_num.
+    """
     data = json.load(open('sync_channels.json', 'r', encoding="utf8"))
-    for index, entry in enumerate(data):
-        if entry['line_group_id'] == line_group_id:
-            subscribed_info = entry.copy()
-            return subscribed_info
-    return {}
+    routes = [entry.copy() for entry in data
+              if str(entry['discord_channel_id']) == str(discord_channel_id)]
+    return sorted(routes, key=lambda x: x.get('sub_num', 0))
+
+
+def get_sync_routes_by_line_group_id(line_group_id):
+    """Get every sync route of a line group.
+
+    A line group can be synced with several discord channels, each of them is a route.
+
+    :param str line_group_id: Line group id.
+    :return list: Subscribed info of each route, sorted by sub_num.
+    """
+    data = json.load(open('sync_channels.json', 'r', encoding="utf8"))
+    routes = [entry.copy() for entry in data if entry['line_group_id'] == line_group_id]
+    return sorted(routes, key=lambda x: x.get('sub_num', 0))
+
+
+def is_sync_route_exists(line_group_id, discord_channel_id):
+    """Check if a line group is already synced with a discord channel.
+
+    :param str line_group_id: Line group id.
+    :param str discord_channel_id: Discord channel id.
+    :return bool: True if the route exists.
+    """
+    routes = get_sync_routes_by_line_group_id(line_group_id)
+    return any(str(route['discord_channel_id']) == str(discord_channel_id) for route in routes)
+
+
+fan_out_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='fan_out')
+
+
+def fan_out(deliver, routes, *args, **kwargs):
+    """Deliver one prepared message to every route concurrently.
+
+    The message should be downloaded and transcoded before calling this function, so the same
+    files are shared by every route. Failures are isolated, one broken route will not block the
+    others.
+
+    :param deliver: Function that delivers to a single route, called as deliver(route, *args,
+    **kwargs).
+    :param list routes: Subscribed info of each route.
+    :return list: Sub nums of the routes that failed.
+    """
+    futures = {fan_out_executor.submit(deliver, route, *args, **kwargs): route for route in routes}
+    failed = []
+    for future, route in futures.items():
+        try:
+            future.result()
+        except Exception as e:
+            print(f"Failed to deliver to sync channel {route.get('sub_num')}: {e}")
+            failed.append(route.get('sub_num'))
+    return failed
 
 
 def get_subscribed_info_by_sub_num(sub_num):
@@ -200,16 +341,14 @@ def add_new_sync_channel(line_group_id, line_group_name, line_notify_token,
     update_json('sync_channels.json', data)
 
 
-def remove_sync_channel_by_discord_channel_id(discord_channel_id):
-    """Remove sync channel by discord channel id.
+def remove_sync_channel_by_sub_num(sub_num):
+    """Remove a single sync route by sub num.
 
-    :param int discord_channel_id: Discord channel id.
+    :param int sub_num: Subscribed sync channels num.
     """
     data = json.load(open('sync_channels.json', 'r', encoding="utf8"))
-    for index, entry in enumerate(data):
-        if entry['discord_channel_id'] == discord_channel_id:
-            data.pop(index)
-            update_json('sync_channels.json', data)
+    data = [entry for entry in data if entry['sub_num'] != sub_num]
+    update_json('sync_channels.json', data)
 
 
 def get_discord_webhook_bot_ids():
@@ -361,6 +500,16 @@ def get_binding_code_info(binding_code):
     return {}
 
 
+def get_command_cache():
+    """Get cached discord command tree hash and command ids.
+
+    :return dict: Command cache. Include tree_hash and command_ids.
+    """
+    if not os.path.exists('./command_cache.json'):
+        return {}
+    return json.load(open('command_cache.json', 'r', encoding="utf8"))
+
+
 def update_json(file, data):
     """Update a json file.
 
@@ -0,0 +1,289 @@
+"""This python file will dispatch messages to Discord webhooks."""
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import requests
+
+MAX_MESSAGE_LENGTH = 2000
+MAX_RETRIES = 3
+MAX_RATE_LIMIT_RETRIES = 5
+RESET_MARGIN = 0.05
+
+
+class RateLimitBucket:
+    """Rate limit state of a Discord bucket, read from X-RateLimit-* headers."""
+
+    def __init__(self):
+        self.remaining = 1
+        self.reset_at = 0.0
+
+    def update(self, headers):
+        """Update bucket state by response headers.
+
+        :param headers: Response headers from Discord.
+        """
+        if 'X-RateLimit-Remaining' in headers:
+            self.remaining = int(headers['X-RateLimit-Remaining'])
+        if 'X-RateLimit-Reset-After' in headers:
+            self.reset_at = time.monotonic() + float(headers['X-RateLimit-Reset-After'])
+
+    def delay(self):
+        """Get how long to wait before the next request can be sent.
+
+        :return float: Seconds to wait.
+        """
+        if self.remaining > 0:
+            return 0.0
+        return max(0.0, self.reset_at - time.monotonic() + RESET_MARGIN)
+
+    def consume(self):
+        """Count a request that is about to be sent."""
+        if self.reset_at <= time.monotonic():
+            self.remaining = max(self.remaining, 1)
+        self.remaining -= 1
+
+
+class WebhookJob:
+    """A message waiting to be sent to a webhook."""
+
+    def __init__(self, content=None, username=None, avatar_url=None, file_path=None):
+        self.content = content
+        self.username = username
+        self.avatar_url = avatar_url
+        self.file_path = file_path
+        self.future = Future()
+
+    def can_merge(self, other, length):
+        """Check if another job can be merged into this one.
+
+        Only text messages from the same author can be merged.
+
+        :param WebhookJob other: The job after this one.
+        :param int length: Length of the content merged so far.
+        :return bool: True if they can be merged.
+        """
+        return (self.file_path is None and other.file_path is None
+                and self.content is not None and other.content is not None
+                and self.username == other.username and self.avatar_url == other.avatar_url
+                and length + len(other.content) + 1 <= MAX_MESSAGE_LENGTH)
+
+
+class WebhookQueue:
+    """Jobs of a single webhook, sent in order by one worker thread."""
+
+    def __init__(self):
+        self.jobs = deque()
+        self.condition = threading.Condition()
+
+    def put(self, job):
+        """Put a job into the queue.
+
+        :param WebhookJob job: Job to send.
+        """
+        with self.condition:
+            self.jobs.append(job)
+            self.condition.notify()
+
+    def take(self, merge=True):
+        """Take the next jobs to send, blocks until there is one.
+
+        Consecutive text jobs from the same author are taken together so they can be sent as
+        a single webhook post.
+
+        :param bool merge: Whether to merge consecutive text jobs.
+        :return list: Jobs to send in one post.
+        """
+        with self.condition:
+            while not self.jobs:
+                self.condition.wait()
+            jobs = [self.jobs.popleft()]
+            length = len(jobs[0].content or '')
+            while merge and self.jobs and jobs[0].can_merge(self.jobs[0], length):
+                jobs.append(self.jobs.popleft())
+                length += len(jobs[-1].content) + 1
+            return jobs
+
+
+class WebhookDispatcher:
+    """Send messages to Discord webhooks without hitting rate limits.
+
+    Every webhook has its own queue and worker thread so messages of a channel are delivered in
+    order, while the rate limit buckets and the global limit reported by Discord are tracked
+    to schedule each send right after the bucket resets.
+    """
+
+    def __init__(self, merge_messages=True):
+        """Initialize dispatcher.
+
+        :param bool merge_messages: Whether to merge consecutive text messages from the same
+        author into one webhook post.
+        """
+        self.merge_messages = merge_messages
+        self.session = requests.Session()
+        self.lock = threading.Lock()
+        self.queues = {}
+        self.buckets = {}
+        self.webhook_buckets = {}
+        self.global_reset_at = 0.0
+
+    def send(self, webhook_url, content=None, username=None, avatar_url=None, file_path=None):
+        """Queue a message to send to webhook.
+
+        :param str webhook_url: Discord webhook url.
+        :param str content: Text message.
+        :param str username: Webhook username.
+        :param str avatar_url: Webhook avatar url.
+        :param str file_path: Path of the file to send.
+        :return Future: Resolves to the message object returned by Discord.
+        """
+        job = WebhookJob(content, username, avatar_url, file_path)
+        job.future.add_done_callback(_print_failure)
+        with self.lock:
+            if webhook_url not in self.queues:
+                self.queues[webhook_url] = WebhookQueue()
+                threading.Thread(target=self._worker, args=(webhook_url,),
+                                 name=f'webhook_{len(self.queues)}', daemon=True).start()
+            webhook_queue = self.queues[webhook_url]
+        webhook_queue.put(job)
+        return job.future
+
+    def _worker(self, webhook_url):
+        """Send queued jobs of a webhook one post at a time.
+
+        :param str webhook_url: Discord webhook url.
+        """
+        webhook_queue = self.queues[webhook_url]
+        while True:
+            jobs = webhook_queue.take(self.merge_messages)
+            try:
+                message = self._post(webhook_url, jobs)
+            except Exception as e:
+                for job in jobs:
+                    job.future.set_exception(e)
+            else:
+                for job in jobs:
+                    job.future.set_result(message)
+
+    def _post(self, webhook_url, jobs):
+        """Post jobs to webhook as a single message, waiting for rate limits.
+
+        :param str webhook_url: Discord webhook url.
+        :param list jobs: Jobs to send in one post.
+        :return dict: Message object returned by Discord.
+        :raises requests.HTTPError: If the post is still rate limited after
+        MAX_RATE_LIMIT_RETRIES retries, or fails for another reason.
+        """
+        content = None
+        if jobs[0].content is not None:
+            content = '\n'.join(job.content for job in jobs)
+        payload = {'content': content,
+                   'username': jobs[0].username, 'avatar_url': jobs[0].avatar_url}
+        payload = {key: value for key, value in payload.items() if value is not None}
+        retries = 0
+        rate_limited = 0
+        while True:
+            time.sleep(self._delay(webhook_url))
+            self._consume(webhook_url)
+            try:
+                response = self._request(webhook_url, payload, jobs[0].file_path)
+            except requests.RequestException:
+                retries += 1
+                if retries > MAX_RETRIES:
+                    raise
+                time.sleep(retries)
+                continue
+            self._update_rate_limit(webhook_url, response)
+            # Don't retry forever, e.g. on a Cloudflare ban or a retry_after of 0, every later
+            # message of the webhook is waiting behind this one.
+            if response.status_code == 429 and rate_limited < MAX_RATE_LIMIT_RETRIES:
+                rate_limited += 1
+                continue
+            if response.status_code >= 500 and retries < MAX_RETRIES:
+                retries += 1
+                time.sleep(retries)
+                continue
+            response.raise_for_status()
+            return response.json()
+
+    def _request(self, webhook_url, payload, file_path=None):
+        """Execute the webhook.
+
+        :param str webhook_url: Discord webhook url.
+        :param dict payload: Json payload of the message.
+        :param str file_path: Path of the file to send.
+        :return requests.Response: Response from Discord.
+        """
+        params = {'wait': 'true'}
+        if file_path is None:
+            return self.session.post(webhook_url, params=params, json=payload, timeout=10)
+        with open(file_path, 'rb') as f:
+            files = {'files[0]': (os.path.basename(file_path), f)}
+            data = {'payload_json': json.dumps(payload, ensure_ascii=False)}
+            return self.session.post(webhook_url, params=params, data=data, files=files,
+                                     timeout=60)
+
+    def _delay(self, webhook_url):
+        """Get how long to wait before the webhook can be executed.
+
+        :param str webhook_url: Discord webhook url.
+        :return float: Seconds to wait.
+        """
+        with self.lock:
+            delay = max(0.0, self.global_reset_at - time.monotonic())
+            bucket = self.buckets.get(self.webhook_buckets.get(webhook_url))
+            if bucket is not None:
+                delay = max(delay, bucket.delay())
+            return delay
+
+    def _consume(self, webhook_url):
+        """Count a request of the webhook against its bucket.
+
+        :param str webhook_url: Discord webhook url.
+        """
+        with self.lock:
+            bucket = self.buckets.get(self.webhook_buckets.get(webhook_url))
+            if bucket is not None:
+                bucket.consume()
+
+    def _update_rate_limit(self, webhook_url, response):
+        """Update rate limit state by response.
+
+        :param str webhook_url: Discord webhook url.
+        :param requests.Response response: Response from Discord.
+        """
+        headers = response.headers
+        with self.lock:
+            # The bucket hash leaves out the webhook id, which is a major parameter, so
+            # webhooks of different channels get the same hash but are limited separately.
+            bucket_id = f"{headers.get('X-RateLimit-Bucket', '')}:{webhook_url}"
+            previous_bucket_id = self.webhook_buckets.get(webhook_url)
+            if previous_bucket_id not in (None, bucket_id):
+                self.buckets.pop(previous_bucket_id, None)
+            self.webhook_buckets[webhook_url] = bucket_id
+            bucket = self.buckets.setdefault(bucket_id, RateLimitBucket())
+            bucket.update(headers)
+            if response.status_code != 429:
+                return
+            try:
+                retry_after = float(response.json().get('retry_after', 1))
+            except ValueError:
+                retry_after = float(headers.get('Retry-After', 1))
+            reset_at = time.monotonic() + retry_after
+            if headers.get('X-RateLimit-Global') or headers.get('X-RateLimit-Scope') == 'global':
+                self.global_reset_at = max(self.global_reset_at, reset_at)
+            else:
+                bucket.remaining = 0
+                bucket.reset_at = max(bucket.reset_at, reset_at)
+
+
+def _print_failure(future):
+    """Print the error of a failed job.
+
+    :param Future future: Future of the job.
+    """
+    if future.exception() is not None:
+        print(f"Failed to send message to discord webhook: {future.exception()}")